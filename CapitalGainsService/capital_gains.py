@@ -1,59 +1,156 @@
-from flask import Flask, request, jsonify
+from flask import request
 from flask_restful import Resource
-import requests
-import os
+
+from common.jobs import JobQueueFull
+from common.price_source import PriceUnavailable
+from holdings_replica import PortfolioNotFound
 
 STOCKS1_URL = "http://stocks-1a:8000"
-API_KEY = os.getenv("NINJA_API_KEY")
+
+
+def fetch_stocks(query_params, replicas):
+    """
+    Retrieves the stocks selected by the query filters from the local replica of the portfolio,
+    after syncing it with the changes made in the stocks service.
+
+    Args:
+        query_params (dict): The portfolio, numsharesgt and numshareslt query parameters.
+        replicas (HoldingsReplicas): The replicas of the stocks service portfolios.
+
+    Returns:
+        tuple: (list of stocks, portfolio version of the replica).
+    """
+    portfolio = query_params.get("portfolio", None)
+    numsharesgt = query_params.get("numsharesgt", None)
+    numshareslt = query_params.get("numshareslt", None)
+
+    # Share filters are applied on the sorted shares index of the replica
+    filters = {}
+    if numsharesgt:
+        filters['numsharesgt'] = int(numsharesgt)
+    if numshareslt:
+        filters['numshareslt'] = int(numshareslt)
+    return replicas.get(portfolio).query(filters)
+
+
+def compute_capital_gains(stocks, price_source, progress=None, batch_size=None):
+    """
+    Calculates the capital gains of stocks using live prices, or the last known ones
+    if the price API is failing.
+
+    Args:
+        stocks (list): The stocks.
+        price_source (PriceSource): The source of current prices.
+        progress (callable): Optional callback receiving {"priced", "total", "prices"} after each batch of symbols.
+        batch_size (int): Number of symbols priced per batch, all at once if None.
+
+    Returns:
+        tuple: (total capital gain rounded to 2 decimals, list of "symbol=as_of" for stale prices).
+
+    Raises:
+        PriceUnavailable: If a symbol has no price at all.
+    """
+    symbols = list(dict.fromkeys(stock['symbol'] for stock in stocks))
+    batch_size = batch_size or len(symbols) or 1
+    quotes = {}
+    for start in range(0, len(symbols), batch_size):
+        quotes.update(price_source.quotes(symbols[start:start + batch_size]))
+        if progress:
+            progress({"priced": len(quotes), "total": len(symbols), "prices": dict(quotes)})
+
+    total_capital_gain = 0
+    stale = []
+    for stock in stocks:
+        symbol = stock['symbol']
+        shares = stock['shares']
+        purchase_price = stock['purchase price']
+
+        quote = quotes[symbol]
+        if quote is None:
+            continue
+        if quote['stale']:
+            stale.append(f"{symbol}={quote['as_of']}")
+        current_price = quote['price']
+
+        if current_price is not None:
+            stock_value = shares * current_price
+            gain = stock_value - (shares * purchase_price)
+            total_capital_gain += gain
+    return round(total_capital_gain, 2), stale
+
 
 class CapitalGains(Resource):
+    def __init__(self, price_source, replicas):
+        self.price_source = price_source
+        self.replicas = replicas
+
     def get(self):
         """
         GET /capital-gains
         Calculates capital gains for all stocks or based on query filters.
+        While the price source is failing, last known prices are used and the stale
+        symbols are listed in the X-Stale-Prices header as symbol=as_of pairs.
         """
         try:
-            # Get query parameters
-            query_params = request.args
-            portfolio = query_params.get("portfolio", None)
-            numsharesgt = query_params.get("numsharesgt", None)
-            numshareslt = query_params.get("numshareslt", None)
-
-            # Determine which stock service to query
-            stocks_url = f"{STOCKS1_URL}/stocks"
-            stocks1_response = requests.get(f"{STOCKS1_URL}/stocks")
-            stocks = stocks1_response.json()
-
-            # If filtering by portfolio
-            if portfolio:
-                response = requests.get(stocks_url)
-                stocks = response.json()
-
-            # Apply additional filters for shares
-            if numsharesgt:
-                stocks = [stock for stock in stocks if stock['shares'] > int(numsharesgt)]
-            if numshareslt:
-                stocks = [stock for stock in stocks if stock['shares'] < int(numshareslt)]
-
-            # Calculate capital gains
-            total_capital_gain = 0
-            for stock in stocks:
-                symbol = stock['symbol']
-                shares = stock['shares']
-                purchase_price = stock['purchase price']
-
-                # Fetch live price from external API
-                price_url = f'https://api.api-ninjas.com/v1/stockprice?ticker={symbol}'
-                response = requests.get(price_url, headers={'X-Api-Key': API_KEY})
-                json_price = response.json()
-                current_price = json_price['price']
-
-                if current_price is not None:
-                    stock_value = shares * current_price
-                    gain = stock_value - (shares * purchase_price)
-                    total_capital_gain += gain
-
-            return round(total_capital_gain, 2)
+            stocks, version = fetch_stocks(request.args, self.replicas)
+            total_capital_gain, stale = compute_capital_gains(stocks, self.price_source)
+            if stale:
+                return total_capital_gain, 200, {'X-Stale-Prices': ','.join(stale)}
+            return total_capital_gain
 
+        except PortfolioNotFound:
+            return {"error": "Not found"}, 404
+        except PriceUnavailable as e:
+            return {"error": str(e)}, 503
         except Exception as e:
             return {"error": str(e)}, 500
+
+
+class CapitalGainsJob(Resource):
+    def __init__(self, price_source, replicas, jobs, job_batch):
+        self.price_source = price_source
+        self.replicas = replicas
+        self.jobs = jobs
+        self.job_batch = job_batch
+
+    def post(self):
+        """
+        POST /jobs/capital-gains
+        Starts calculating capital gains in the background, with the same query filters as GET /capital-gains.
+        Calculations are memoized per filters and portfolio version, so repeated requests share one job.
+        """
+        try:
+            stocks, version = fetch_stocks(request.args, self.replicas)
+            key = ("capital-gains", request.args.get("portfolio"), request.args.get("numsharesgt"),
+                   request.args.get("numshareslt"), version)
+
+            def compute(progress):
+                try:
+                    total_capital_gain, stale = compute_capital_gains(stocks, self.price_source, progress, self.job_batch)
+                except PriceUnavailable as e:
+                    return {"error": str(e)}, 503
+                return {"capital gains": total_capital_gain, "stale prices": stale}, 200
+
+            job = self.jobs.submit("capital-gains", key, compute)
+        except PortfolioNotFound:
+            return {"error": "Not found"}, 404
+        except JobQueueFull as e:
+            return {"error": str(e)}, 503
+        except Exception as e:
+            return {"error": str(e)}, 500
+        return {"id": job.id, "state": job.state}, 202, {"Location": f"/jobs/{job.id}"}
+
+
+class JobID(Resource):
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    def get(self, id):
+        """
+        GET /jobs/<id>
+        Reports the state, progress (symbols priced so far) and, once done, the result of a job.
+        """
+        job = self.jobs.get(id)
+        if job is None:
+            return {"error": "Not found"}, 404
+        return job.to_dict(), 200
@@ -0,0 +1,122 @@
+import threading
+from collections import OrderedDict
+
+from common.holdings_index import HoldingsIndex
+
+
+class PortfolioNotFound(Exception):
+    """
+    Raised when the stocks service has no portfolio of the requested name.
+    """
+
+
+class HoldingsReplica:
+    """
+    Local copy of the holdings of one portfolio of the stocks service, kept in sync through
+    GET /stocks/changes so each sync only transfers what changed since the previous one.
+    """
+    def __init__(self, changes_url, page_size=1000, timeout=5):
+        """
+        Args:
+            changes_url (str): URL of the changes endpoint of the portfolio.
+            page_size (int): Maximum number of changes fetched per request.
+            timeout (float): Seconds to wait for the stocks service.
+        """
+        self.changes_url = changes_url
+        self.page_size = page_size
+        self.timeout = timeout
+        self.holdings = HoldingsIndex()
+        self.seq = 0
+        self.lock = threading.Lock()
+
+    def sync(self):
+        """
+        Applies the changes made since the last sync, replacing the holdings if the stocks service asks for a resync.
+
+        Returns:
+            int: The portfolio version the replica is at.
+
+        Raises:
+            PortfolioNotFound: If the stocks service has no such portfolio.
+            requests.HTTPError: If the stocks service rejects the request.
+        """
+        import requests
+        with self.lock:
+            while True:
+                response = requests.get(self.changes_url, params={"since": self.seq, "limit": self.page_size}, timeout=self.timeout)
+                if response.status_code == 404:
+                    raise PortfolioNotFound(self.changes_url)
+                response.raise_for_status()
+                page = response.json()
+                if page["resync"]:
+                    self.holdings = HoldingsIndex(page["stocks"])
+                    self.seq = page["seq"]
+                    return self.seq
+                for change in page["changes"]:
+                    if change["op"] == "delete":
+                        self.holdings.remove(change["id"])
+                    else:
+                        self.holdings.put(change["stock"])
+                self.seq = page["seq"]
+                if not page["more"]:
+                    return self.seq
+
+    def query(self, filters=None):
+        """
+        Syncs the replica and returns the stocks matching query filters.
+
+        Args:
+            filters (dict): Optional query filters, see HoldingsIndex.query.
+
+        Returns:
+            tuple: (list of matching stocks, portfolio version they reflect).
+        """
+        seq = self.sync()
+        with self.lock:
+            return self.holdings.query(filters), seq
+
+
+class HoldingsReplicas:
+    """
+    The holdings replicas of the most recently queried portfolios, created on first use.
+    """
+    def __init__(self, stocks_url, page_size=1000, max_replicas=100):
+        """
+        Args:
+            stocks_url (str): Base URL of the stocks service.
+            page_size (int): Maximum number of changes fetched per request.
+            max_replicas (int): Replicas kept, the least recently used one is dropped beyond it.
+        """
+        self.stocks_url = stocks_url
+        self.page_size = page_size
+        self.max_replicas = max_replicas
+        self.replicas = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, portfolio=None):
+        """
+        Returns the replica of a portfolio.
+
+        Args:
+            portfolio (str): The portfolio name, the default portfolio of the stocks service if None.
+
+        Returns:
+            HoldingsReplica: The replica, synced on first use so unknown portfolios are not kept.
+
+        Raises:
+            PortfolioNotFound: If the stocks service has no such portfolio.
+        """
+        with self.lock:
+            replica = self.replicas.get(portfolio)
+            if replica is not None:
+                self.replicas.move_to_end(portfolio)
+                return replica
+        changes_url = f"{self.stocks_url}/portfolios/{portfolio}/stocks/changes" if portfolio else f"{self.stocks_url}/stocks/changes"
+        replica = HoldingsReplica(changes_url, self.page_size)
+        replica.sync()
+        with self.lock:
+            replica = self.replicas.setdefault(portfolio, replica)
+            self.replicas.move_to_end(portfolio)
+            while len(self.replicas) > self.max_replicas:
+                self.replicas.popitem(last=False)
+        return replica
@@ -1,12 +1,45 @@
+import os
+
 from flask import Flask
 from flask_restful import Api
-from capital_gains import CapitalGains  # Import the existing CapitalGains class
 
-app = Flask(__name__)
-api = Api(app)
 
-# Register the CapitalGains resource with the Flask app
-api.add_resource(CapitalGains, '/capital-gains')
+def create_app():
+    """
+    Creates the capital gains service Flask app.
+
+    Returns:
+        Flask: The configured app.
+    """
+    from capital_gains import STOCKS1_URL, CapitalGains, CapitalGainsJob, JobID  # Import the existing CapitalGains class
+    from common.circuit_breaker import CircuitBreaker
+    from common.jobs import JobManager
+    from common.price_cache import PriceCache
+    from common.price_providers import provider_from_env
+    from common.price_source import PriceSource
+    from common.profiling import install_profiling
+    from holdings_replica import HoldingsReplicas
+
+    price_source = PriceSource(
+        provider_from_env(),
+        PriceCache(float(os.getenv('PRICE_CACHE_TTL', '60'))),
+        CircuitBreaker(int(os.getenv('PRICE_BREAKER_THRESHOLD', '5')), float(os.getenv('PRICE_BREAKER_RESET', '30'))),
+    )
+
+    jobs = JobManager(int(os.getenv('JOB_WORKERS', '4')), int(os.getenv('JOB_MAX_PENDING', '100')), float(os.getenv('JOB_TTL', '60')))
+    job_batch = int(os.getenv('JOB_BATCH', '25'))
+    replicas = HoldingsReplicas(os.getenv('STOCKS_URL', STOCKS1_URL), int(os.getenv('CHANGES_PAGE_SIZE', '1000')),
+                                 int(os.getenv('MAX_PORTFOLIOS', '100')))
+
+    app = Flask(__name__)
+    api = Api(app)
+
+    # Register the CapitalGains resource with the Flask app
+    api.add_resource(CapitalGains, '/capital-gains', resource_class_args = [price_source, replicas])
+    api.add_resource(CapitalGainsJob, '/jobs/capital-gains', resource_class_args = [price_source, replicas, jobs, job_batch])
+    api.add_resource(JobID, '/jobs/<string:id>', resource_class_args = [jobs])
+    install_profiling(app)
+    return app
 
 if __name__ == "__main__":
-    app.run(host='0.0.0.0', port=8080)  # Run on port 8080
+    create_app().run(host='0.0.0.0', port=int(os.getenv('PORT', '8080')))  # Run on port 8080
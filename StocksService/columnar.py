@@ -0,0 +1,288 @@
+"""
+Columnar export and import of portfolios, as Arrow IPC streams or Parquet files.
+
+Stocks are moved in record batches, so neither side materializes the whole collection,
+and Arrow data read from memory-mapped files or sliced into batches is not copied.
+pyarrow is optional: it is imported on first use and MissingPyArrow is raised without it.
+
+    python columnar.py export --portfolio stocks1a --format parquet stocks1a.parquet
+    python columnar.py import --portfolio restored --format parquet stocks1a.parquet
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+FORMATS = {
+    "arrow": "application/vnd.apache.arrow.stream",
+    "parquet": "application/vnd.apache.parquet",
+}
+
+
+class MissingPyArrow(Exception):
+    """
+    Raised when a columnar format is requested but pyarrow is not installed.
+    """
+
+
+class ImportRejected(Exception):
+    """
+    Raised when a batch of an import is rejected, after the previous batches were inserted.
+    """
+    def __init__(self, imported):
+        super().__init__(f"Malformed data after {imported} stocks")
+        self.imported = imported
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError:
+        raise MissingPyArrow("pyarrow is not installed")
+    return pyarrow
+
+
+def schema():
+    """
+    Returns the Arrow schema of exported stocks.
+
+    Returns:
+        pyarrow.Schema: One column per stock field.
+    """
+    pa = _pyarrow()
+    return pa.schema([
+        ("id", pa.string()),
+        ("name", pa.string()),
+        ("symbol", pa.string()),
+        ("purchase price", pa.float64()),
+        ("purchase date", pa.string()),
+        ("shares", pa.int64()),
+    ])
+
+
+def record_batches(stocks, batch_size):
+    """
+    Groups stocks into Arrow record batches.
+
+    Args:
+        stocks (iterable): The stocks.
+        batch_size (int): Number of stocks per batch.
+
+    Returns:
+        generator: The record batches.
+    """
+    pa = _pyarrow()
+    stocks_schema = schema()
+    columns = {field: [] for field in stocks_schema.names}
+    count = 0
+    for stock in stocks:
+        for field, values in columns.items():
+            values.append(stock.get(field))
+        count += 1
+        if count == batch_size:
+            yield pa.RecordBatch.from_pydict(columns, schema=stocks_schema)
+            columns = {field: [] for field in stocks_schema.names}
+            count = 0
+    if count:
+        yield pa.RecordBatch.from_pydict(columns, schema=stocks_schema)
+
+
+class _ChunkSink:
+    """
+    Write-only file collecting what a writer produced since the last drain, so it can be streamed.
+    """
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+        self.closed = False
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _writer(fmt, sink):
+    pa = _pyarrow()
+    if fmt == "parquet":
+        return pa.parquet.ParquetWriter(sink, schema())
+    return pa.ipc.new_stream(sink, schema())
+
+
+def stream_export(stocks, fmt, batch_size):
+    """
+    Encodes stocks in a columnar format, chunk by chunk.
+
+    Args:
+        stocks (iterable): The stocks.
+        fmt (str): "arrow" or "parquet".
+        batch_size (int): Number of stocks per record batch, and per Parquet row group.
+
+    Returns:
+        generator: The encoded bytes, one chunk per record batch.
+    """
+    sink = _ChunkSink()
+    writer = _writer(fmt, sink)
+    for batch in record_batches(stocks, batch_size):
+        writer.write_batch(batch)
+        chunk = sink.drain()
+        if chunk:
+            yield chunk
+    writer.close()
+    yield sink.drain()
+
+
+def export_to_file(stocks, fmt, path, batch_size):
+    """
+    Writes stocks to a columnar file.
+
+    Args:
+        stocks (iterable): The stocks.
+        fmt (str): "arrow" or "parquet".
+        path (str): The file to write.
+        batch_size (int): Number of stocks per record batch.
+
+    Returns:
+        int: Number of stocks written.
+    """
+    count = 0
+    with open(path, "wb") as f:
+        writer = _writer(fmt, f)
+        for batch in record_batches(stocks, batch_size):
+            writer.write_batch(batch)
+            count += batch.num_rows
+        writer.close()
+    return count
+
+
+def read_batches(source, fmt, batch_size):
+    """
+    Decodes record batches from a columnar source, sliced to at most batch_size rows without copying.
+
+    Args:
+        source: A file path, memory-mapped for zero-copy reads, or a readable file object.
+            Parquet file objects must be seekable.
+        fmt (str): "arrow" or "parquet".
+        batch_size (int): Maximum number of rows per batch.
+
+    Returns:
+        generator: The record batches.
+    """
+    pa = _pyarrow()
+    if fmt == "parquet":
+        batches = pa.parquet.ParquetFile(source, memory_map=isinstance(source, str)).iter_batches(batch_size=batch_size)
+    else:
+        batches = pa.ipc.open_stream(pa.memory_map(source) if isinstance(source, str) else source)
+    for batch in batches:
+        for offset in range(0, batch.num_rows, batch_size):
+            yield batch.slice(offset, batch_size)
+
+
+def spool(stream, max_memory=64 * 1024 * 1024):
+    """
+    Copies a non-seekable stream to a seekable file, kept in memory up to max_memory bytes.
+
+    Args:
+        stream: The readable stream, e.g. a request body.
+        max_memory (int): Bytes kept in memory before spilling to disk.
+
+    Returns:
+        SpooledTemporaryFile: The copy, positioned at its start.
+    """
+    f = tempfile.SpooledTemporaryFile(max_size=max_memory)
+    while True:
+        chunk = stream.read(1024 * 1024)
+        if not chunk:
+            break
+        f.write(chunk)
+    f.seek(0)
+    return f
+
+
+def import_batches(portfolio, batches):
+    """
+    Inserts record batches into a portfolio with one insert_many per batch.
+
+    Args:
+        portfolio (StockPortfolio): The portfolio.
+        batches (iterable): The record batches.
+
+    Returns:
+        int: Number of stocks inserted.
+
+    Raises:
+        ImportRejected: If a batch cannot be decoded or holds invalid or already taken stocks.
+            Earlier batches stay inserted.
+    """
+    pa = _pyarrow()
+    imported = 0
+    batches = iter(batches)
+    while True:
+        try:
+            batch = next(batches, None)
+        except (pa.ArrowInvalid, OSError):
+            raise ImportRejected(imported)
+        if batch is None:
+            break
+        request_status, count = portfolio.insert_stocks(batch.to_pylist())
+        if request_status != 201:
+            raise ImportRejected(imported)
+        imported += count
+    return imported
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or import a portfolio as Arrow IPC or Parquet.")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("path", help="Columnar file to write or read")
+    parser.add_argument("--portfolio", help="Portfolio name, PORTFOLIO by default")
+    parser.add_argument("--format", choices=sorted(FORMATS), help="Inferred from the file extension by default")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    args = parser.parse_args(argv)
+
+    from services import Services
+    from stock_portfolio import StockPortfolio
+    fmt = args.format or ("parquet" if args.path.endswith(".parquet") else "arrow")
+    services = Services.from_env()
+    if args.portfolio and not services.valid_portfolio_name(args.portfolio):
+        parser.error(f"invalid portfolio name: {args.portfolio}")
+    if args.command == "export" and not services.portfolio_exists(args.portfolio):
+        parser.error(f"unknown portfolio: {args.portfolio}")
+    # A plain portfolio, without the snapshot and write-behind log of a server that may be running,
+    # which notices the import through the portfolio version like any other write
+    name = args.portfolio or services.portfolio_name
+    portfolio = StockPortfolio(services.db()[name], max_changes=services.max_changes, hole_timeout=services.changes_hole_timeout)
+    portfolio.ensure_indexes()
+    try:
+        if args.command == "export":
+            count = export_to_file(portfolio.export_stocks(args.batch_size), fmt, args.path, args.batch_size)
+            print(f"Exported {count} stocks to {args.path}")
+        else:
+            count = import_batches(portfolio, read_batches(args.path, fmt, args.batch_size))
+            print(f"Imported {count} stocks from {args.path}")
+    except (MissingPyArrow, ImportRejected) as e:
+        print(e, file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    sys.exit(main())
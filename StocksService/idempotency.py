@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+
+
+class MemoryIdempotencyStore:
+    """
+    Remembers the response of each Idempotency-Key in memory, as an LRU bounded to max_keys entries.
+    Records are of the form {"fingerprint", "state" ("pending" or "done"), "status", "body"}.
+    """
+    def __init__(self, ttl, max_keys, lease=30):
+        """
+        Args:
+            ttl (float): Seconds a key is remembered.
+            max_keys (int): Maximum number of keys remembered.
+            lease (float): Seconds a key stays reserved without a response before a retry can take it over.
+        """
+        self.ttl = ttl
+        self.max_keys = max_keys
+        self.lease = lease
+        self.records = OrderedDict()
+        self.lock = threading.Lock()
+
+    def begin(self, key, fingerprint):
+        """
+        Reserves a key for a new request, unless it is already known.
+
+        Args:
+            key (str): The Idempotency-Key header.
+            fingerprint (str): Hash of the request payload.
+
+        Returns:
+            dict: The existing record of the key, or None if the key was reserved for this request,
+                including when a previous reservation was never completed within the lease.
+        """
+        now = time.monotonic()
+        with self.lock:
+            record = self.records.get(key)
+            if record is not None and now - record["created_at"] <= self.ttl:
+                if record["state"] != "pending" or now < record["pending_until"]:
+                    self.records.move_to_end(key)
+                    return record
+            self.records[key] = {"fingerprint": fingerprint, "state": "pending", "created_at": now, "pending_until": now + self.lease}
+            self.records.move_to_end(key)
+            while len(self.records) > self.max_keys:
+                self.records.popitem(last=False)
+            return None
+
+    def complete(self, key, status, body):
+        """
+        Stores the response of a reserved key.
+
+        Args:
+            key (str): The Idempotency-Key header.
+            status (int): The HTTP status code.
+            body (dict): The response body.
+        """
+        with self.lock:
+            record = self.records.get(key)
+            if record is not None:
+                record.update(state="done", status=status, body=body)
+
+    def abandon(self, key):
+        """
+        Releases a reserved key whose request failed, so it can be retried.
+
+        Args:
+            key (str): The Idempotency-Key header.
+        """
+        with self.lock:
+            record = self.records.get(key)
+            if record is not None and record["state"] == "pending":
+                del self.records[key]
+
+
+class MongoIdempotencyStore:
+    """
+    Remembers the response of each Idempotency-Key in a Mongo collection with a TTL index,
+    so replays are recognised across restarts and replicas.
+    Records are of the form {"fingerprint", "state" ("pending" or "done"), "status", "body"}.
+    """
+    def __init__(self, collection, ttl, lease=30):
+        """
+        Args:
+            collection (Collection): The Mongo collection holding the keys.
+            ttl (float): Seconds a key is remembered.
+            lease (float): Seconds a key stays reserved without a response before a retry can take it over,
+                so a worker that crashed mid-request does not block retries until the TTL.
+        """
+        self.keys = collection
+        self.ttl = ttl
+        self.lease = lease
+        self.indexes_ensured = False
+
+    def _ensure_indexes(self):
+        if not self.indexes_ensured:
+            self.keys.create_index("created_at", expireAfterSeconds=int(self.ttl))
+            self.indexes_ensured = True
+
+    def begin(self, key, fingerprint):
+        """
+        Reserves a key for a new request, unless it is already known.
+
+        Args:
+            key (str): The Idempotency-Key header.
+            fingerprint (str): Hash of the request payload.
+
+        Returns:
+            dict: The existing record of the key, or None if the key was reserved for this request,
+                including when a previous reservation was never completed within the lease.
+        """
+        from pymongo.errors import DuplicateKeyError
+        self._ensure_indexes()
+        now = datetime.now(timezone.utc)
+        # The TTL monitor only runs periodically, expired keys may still be around
+        self.keys.delete_one({"_id": key, "created_at": {"$lt": now - timedelta(seconds=self.ttl)}})
+        pending_until = now + timedelta(seconds=self.lease)
+        try:
+            self.keys.insert_one({"_id": key, "fingerprint": fingerprint, "state": "pending", "created_at": now, "pending_until": pending_until})
+            return None
+        except DuplicateKeyError:
+            pass
+        # Only one retry can take over a lapsed reservation, the update matches the old lease
+        taken_over = self.keys.update_one(
+            {"_id": key, "state": "pending", "pending_until": {"$lt": now}},
+            {"$set": {"fingerprint": fingerprint, "created_at": now, "pending_until": pending_until}},
+        )
+        if taken_over.modified_count:
+            return None
+        return self.keys.find_one({"_id": key}) or {"fingerprint": fingerprint, "state": "pending"}
+
+    def complete(self, key, status, body):
+        """
+        Stores the response of a reserved key.
+
+        Args:
+            key (str): The Idempotency-Key header.
+            status (int): The HTTP status code.
+            body (dict): The response body.
+        """
+        self.keys.update_one({"_id": key}, {"$set": {"state": "done", "status": status, "body": body}})
+
+    def abandon(self, key):
+        """
+        Releases a reserved key whose request failed, so it can be retried.
+
+        Args:
+            key (str): The Idempotency-Key header.
+        """
+        self.keys.delete_one({"_id": key, "state": "pending"})
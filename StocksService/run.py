@@ -1,35 +1,63 @@
-from flask_pymongo import PyMongo
-from flask import Flask, jsonify, request, make_response
-import json
-import uuid
-import numbers
-import re
-from flask_restful import Resource, Api, reqparse
-import requests
 import os
-from pymongo import MongoClient
-from datetime import datetime
-from stock_portfolio import *
-from stock_portfolio_API import *
-
-app = Flask(__name__)
-api = Api(app)
-
-app.config['MONGO_URI'] = 'mongodb://localhost:27017/stocks_db'
-client = MongoClient("mongodb://mongodb:27017/")  # Connect to MongoDB Docker container
-db = client['stocks_db']  # Use 'stocks_db' database
-portfolio_name = os.getenv('PORTFOLIO', 'stocks1a')
-collection = db[portfolio_name]
-portfolio = StockPortfolio(collection)
-
-@app.route('/kill', methods=['GET'])
+
+from flask import Flask, abort, g, request
+from flask_restful import Api
+
+
+# Only adding stocks creates a portfolio, any other request for an unknown portfolio is a 404
+CREATING_ENDPOINTS = ('stocks', 'stocksimport')
+
 def kill_container():
     os._exit(1)
 
+def create_app(services=None):
+    """
+    Creates the stocks service Flask app.
+    Mongo is connected and indexed lazily on the first request, so the app is ready to serve immediately.
+
+    Every endpoint is served for the default portfolio (PORTFOLIO) and for any other portfolio
+    named in the path, e.g. /portfolios/<name>/stocks, or in the X-Portfolio header.
+    Each portfolio is stored in its own collection.
+
+    Args:
+        services (Services): Optional preconfigured services, built from the environment by default.
+
+    Returns:
+        Flask: The configured app.
+    """
+    from common.profiling import install_profiling
+    from services import Services
+    from stock_portfolio_API import Stocks, StocksChanges, StocksExport, StocksImport, StocksID, stockValueID, portfolioValue, portfolioValueJob, jobID
+
+    if services is None:
+        services = Services.from_env()
+    app = Flask(__name__)
+    app.extensions['stocks'] = services
+
+    @app.url_value_preprocessor
+    def select_portfolio(endpoint, values):
+        name = (values or {}).pop('portfolio', None) or request.headers.get('X-Portfolio')
+        if name is not None and not services.valid_portfolio_name(name):
+            abort(404)
+        creating = request.method == 'POST' and endpoint in CREATING_ENDPOINTS
+        if name is not None and not creating and not services.portfolio_exists(name):
+            abort(404)
+        g.portfolio_name = name
+
+    api = Api(app)
+    api.add_resource(Stocks, '/stocks', '/portfolios/<string:portfolio>/stocks', resource_class_args = [services])
+    api.add_resource(StocksChanges, '/stocks/changes', '/portfolios/<string:portfolio>/stocks/changes', resource_class_args = [services])
+    api.add_resource(StocksExport, '/stocks/export', '/portfolios/<string:portfolio>/stocks/export', resource_class_args = [services])
+    api.add_resource(StocksImport, '/stocks/import', '/portfolios/<string:portfolio>/stocks/import', resource_class_args = [services])
+    api.add_resource(StocksID, '/stocks/<string:id>', '/portfolios/<string:portfolio>/stocks/<string:id>', resource_class_args = [services])
+    api.add_resource(stockValueID, '/stock-value/<string:id>', '/portfolios/<string:portfolio>/stock-value/<string:id>', resource_class_args = [services])
+    api.add_resource(portfolioValue, '/portfolio-value', '/portfolios/<string:portfolio>/portfolio-value', resource_class_args = [services])
+    api.add_resource(portfolioValueJob, '/jobs/portfolio-value', '/portfolios/<string:portfolio>/jobs/portfolio-value', resource_class_args = [services])
+    api.add_resource(jobID, '/jobs/<string:id>', resource_class_args = [services])
+    app.add_url_rule('/kill', view_func=kill_container, methods=['GET'])
+    install_profiling(app)
+    return app
+
 if __name__ == "__main__":
-    api.add_resource(Stocks, '/stocks', resource_class_args = [portfolio])
-    api.add_resource(StocksID, '/stocks/<string:id>', resource_class_args = [portfolio])
-    api.add_resource(stockValueID, '/stock-value/<string:id>', resource_class_args = [portfolio])
-    api.add_resource(portfolioValue, '/portfolio-value', resource_class_args = [portfolio])
-    # run Flask app
-    app.run(host='0.0.0.0', port=8000, debug=True)
\ No newline at end of file
+    # run Flask app, FLASK_DEBUG=1 enables the debugger and the reloader
+    create_app().run(host='0.0.0.0', port=int(os.getenv('PORT', '8000')), debug=os.getenv('FLASK_DEBUG', '0') == '1')
@@ -0,0 +1,306 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from common.circuit_breaker import CircuitBreaker
+from common.jobs import JobManager
+from common.price_cache import PriceCache
+from common.price_providers import provider_from_env
+from common.price_source import PriceSource
+from idempotency import MemoryIdempotencyStore, MongoIdempotencyStore
+from snapshot import Snapshotter
+from stock_portfolio import StockPortfolio
+
+
+class Services:
+    """
+    Holds the shared objects of the stocks service: the pooled Mongo client, the price source,
+    and one StockPortfolio per portfolio collection served by this process.
+    Nothing touches Mongo until the first request asks for a portfolio, so the app starts
+    serving without waiting on the database.
+
+    At most max_portfolios portfolios are kept, the least recently used ones are closed
+    beyond that. A single thread writes the snapshots of all of them.
+    """
+    PORTFOLIO_NAME = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+    # Collections kept next to each portfolio, which must not be served as portfolios themselves
+    RESERVED_SUFFIXES = ("_meta", "_idempotency", "_changes")
+
+    def __init__(self, mongo_uri, db_name, portfolio_name, snapshot_path, snapshot_interval, price_cache_ttl,
+                 write_behind_log=None, write_behind_batch=500, write_behind_interval=0.5,
+                 price_provider=None, breaker_threshold=5, breaker_reset=30, mongo_options=None,
+                 idempotency_store='mongo', idempotency_ttl=86400, idempotency_max_keys=10000, idempotency_lease=30,
+                 job_workers=4, job_max_pending=100, job_ttl=60, job_batch=25, max_changes=100000,
+                 changes_hole_timeout=30, max_portfolios=100):
+        """
+        Args:
+            mongo_uri (str): Mongo connection string.
+            db_name (str): Name of the database holding the portfolios.
+            portfolio_name (str): Name of the portfolio served when a request does not name one.
+            snapshot_path (str): Location of the warm-start snapshots, "{portfolio}" is replaced by the
+                portfolio name. Empty to disable them.
+            snapshot_interval (float): Seconds between snapshot writes.
+            price_cache_ttl (float): Seconds a fetched price is considered fresh.
+            write_behind_log (str): Durability log of write-behind updates, "{portfolio}" is replaced by the
+                portfolio name. None to write synchronously.
+            write_behind_batch (int): Number of pending stocks that triggers a write-behind flush.
+            write_behind_interval (float): Maximum seconds a write-behind update waits before being flushed.
+            price_provider (PriceProvider): The source of current prices.
+            breaker_threshold (int): Consecutive failed price fetches that open the circuit.
+            breaker_reset (float): Seconds the circuit stays open before probing the price API again.
+            mongo_options (dict): Connection pool options passed to MongoClient.
+            idempotency_store (str): Where Idempotency-Key responses are kept, "mongo" or "memory".
+            idempotency_ttl (float): Seconds an Idempotency-Key is remembered.
+            idempotency_max_keys (int): Maximum number of keys remembered per portfolio by the memory store.
+            idempotency_lease (float): Seconds an Idempotency-Key stays reserved by a request that has not responded.
+            job_workers (int): Number of threads running background valuations.
+            job_max_pending (int): Maximum number of queued or running background valuations.
+            job_ttl (float): Seconds a finished valuation is kept and reused for the same portfolio version.
+            job_batch (int): Number of symbols priced between two progress reports of a valuation.
+            max_changes (int): Maximum number of entries kept in the change log of each portfolio.
+            changes_hole_timeout (float): Seconds a change log entry may be missing before consumers behind it resync.
+            max_portfolios (int): Maximum number of portfolios kept open, the default one included.
+        """
+        self.mongo_uri = mongo_uri
+        self.db_name = db_name
+        self.portfolio_name = portfolio_name
+        self.mongo_options = mongo_options or {}
+        self.client = None
+        self.lock = threading.Lock()
+        self.snapshot_path = snapshot_path
+        self.snapshot_interval = snapshot_interval
+        self.write_behind_log = write_behind_log
+        self.write_behind_batch = write_behind_batch
+        self.write_behind_interval = write_behind_interval
+        self.snapshotters = {}
+        self.snapshot_thread = None
+        if snapshot_path:
+            # Prices are shared by all portfolios, they are warm-started from the default portfolio's snapshot
+            self.snapshotters[portfolio_name] = Snapshotter(snapshot_path.format(portfolio=portfolio_name), portfolio_name)
+        default_snapshotter = self.snapshotters.get(portfolio_name)
+        self.price_cache = PriceCache(price_cache_ttl, warm_start=default_snapshotter.load_prices if default_snapshotter else None)
+        self.price_source = PriceSource(
+            price_provider,
+            self.price_cache,
+            CircuitBreaker(breaker_threshold, breaker_reset),
+        )
+        self.portfolios = OrderedDict()
+        self.max_portfolios = max_portfolios
+        # Evicted portfolios still being closed, which must not be reopened before their write-behind log is released
+        self.closing = set()
+        self.closed = threading.Condition(self.lock)
+        self.idempotency_store_type = idempotency_store
+        self.idempotency_ttl = idempotency_ttl
+        self.idempotency_max_keys = idempotency_max_keys
+        self.idempotency_lease = idempotency_lease
+        self.idempotency_stores = {}
+        self.jobs = JobManager(job_workers, job_max_pending, job_ttl)
+        self.job_batch = job_batch
+        self.max_changes = max_changes
+        self.changes_hole_timeout = changes_hole_timeout
+
+    @classmethod
+    def from_env(cls):
+        """
+        Builds the services from environment variables.
+
+        Returns:
+            Services: The configured services.
+        """
+        return cls(
+            mongo_uri=os.getenv('MONGO_URI', 'mongodb://mongodb:27017/'),
+            db_name=os.getenv('MONGO_DB', 'stocks_db'),
+            portfolio_name=os.getenv('PORTFOLIO', 'stocks1a'),
+            # Set SNAPSHOT_PATH to an empty string to disable the warm-start snapshot
+            snapshot_path=os.getenv('SNAPSHOT_PATH', '/tmp/{portfolio}.snapshot'),
+            snapshot_interval=float(os.getenv('SNAPSHOT_INTERVAL', '30')),
+            price_cache_ttl=float(os.getenv('PRICE_CACHE_TTL', '60')),
+            write_behind_log=os.getenv('WRITE_BEHIND_LOG', '/tmp/{portfolio}.wal') if os.getenv('WRITE_BEHIND') == '1' else None,
+            write_behind_batch=int(os.getenv('WRITE_BEHIND_BATCH', '500')),
+            write_behind_interval=float(os.getenv('WRITE_BEHIND_INTERVAL', '0.5')),
+            price_provider=provider_from_env(),
+            breaker_threshold=int(os.getenv('PRICE_BREAKER_THRESHOLD', '5')),
+            breaker_reset=float(os.getenv('PRICE_BREAKER_RESET', '30')),
+            mongo_options={
+                'maxPoolSize': int(os.getenv('MONGO_MAX_POOL_SIZE', '50')),
+                'minPoolSize': int(os.getenv('MONGO_MIN_POOL_SIZE', '5')),
+                'maxIdleTimeMS': int(os.getenv('MONGO_MAX_IDLE_TIME_MS', '60000')),
+                'serverSelectionTimeoutMS': int(os.getenv('MONGO_SERVER_SELECTION_TIMEOUT_MS', '5000')),
+                'connectTimeoutMS': int(os.getenv('MONGO_CONNECT_TIMEOUT_MS', '5000')),
+                'waitQueueTimeoutMS': int(os.getenv('MONGO_WAIT_QUEUE_TIMEOUT_MS', '5000')),
+            },
+            idempotency_store=os.getenv('IDEMPOTENCY_STORE', 'mongo'),
+            idempotency_ttl=float(os.getenv('IDEMPOTENCY_TTL', '86400')),
+            idempotency_max_keys=int(os.getenv('IDEMPOTENCY_MAX_KEYS', '10000')),
+            idempotency_lease=float(os.getenv('IDEMPOTENCY_LEASE', '30')),
+            job_workers=int(os.getenv('JOB_WORKERS', '4')),
+            job_max_pending=int(os.getenv('JOB_MAX_PENDING', '100')),
+            job_ttl=float(os.getenv('JOB_TTL', '60')),
+            job_batch=int(os.getenv('JOB_BATCH', '25')),
+            max_changes=int(os.getenv('CHANGES_MAX', '100000')),
+            changes_hole_timeout=float(os.getenv('CHANGES_HOLE_TIMEOUT', '30')),
+            max_portfolios=int(os.getenv('MAX_PORTFOLIOS', '100')),
+        )
+
+    def db(self):
+        """
+        Returns the Mongo database, creating the pooled client on first use.
+
+        Returns:
+            Database: The stocks database.
+        """
+        with self.lock:
+            if self.client is None:
+                from pymongo import MongoClient
+                self.client = MongoClient(self.mongo_uri, connect=False, **self.mongo_options)
+            return self.client[self.db_name]
+
+    def valid_portfolio_name(self, name):
+        """
+        Checks if a name can be served as a portfolio collection.
+
+        Args:
+            name (str): The portfolio name.
+
+        Returns:
+            bool: True if valid, False otherwise.
+        """
+        return bool(self.PORTFOLIO_NAME.match(name)) and not name.endswith(self.RESERVED_SUFFIXES)
+
+    def portfolio_exists(self, name):
+        """
+        Checks if a portfolio can be read: the default portfolio always can, others once their collection exists.
+
+        Args:
+            name (str): The portfolio name, the default portfolio if None. Must be a valid portfolio name.
+
+        Returns:
+            bool: True if the portfolio exists, False otherwise.
+        """
+        if name is None or name == self.portfolio_name or name in self.portfolios:
+            return True
+        return bool(self.db().list_collection_names(filter={"name": name}))
+
+    def _create_portfolio(self, name, collection):
+        """
+        Builds the portfolio of a collection along with its snapshotter and write-behind queue.
+        Must be called with the lock held.
+        """
+        snapshotter = self.snapshotters.get(name)
+        if snapshotter is None and self.snapshot_path:
+            snapshotter = Snapshotter(self.snapshot_path.format(portfolio=name), name)
+            self.snapshotters[name] = snapshotter
+        portfolio = StockPortfolio(collection, warm_start=snapshotter.load_holdings if snapshotter else None, max_changes=self.max_changes,
+                                   hole_timeout=self.changes_hole_timeout)
+        if self.write_behind_log:
+            portfolio.enable_write_behind(self.write_behind_log.format(portfolio=name), self.write_behind_batch, self.write_behind_interval)
+        if snapshotter:
+            # Only the default portfolio's snapshot carries the prices, so price fetches do not rewrite every snapshot
+            snapshotter.attach(portfolio, self.price_cache if name == self.portfolio_name else None)
+            if self.snapshot_thread is None:
+                self.snapshot_thread = threading.Thread(target=self._write_snapshots, name="snapshotter", daemon=True)
+                self.snapshot_thread.start()
+        return portfolio
+
+    def _write_snapshots(self):
+        """
+        Writes the snapshot of every open portfolio every snapshot_interval seconds.
+        """
+        while True:
+            time.sleep(self.snapshot_interval)
+            for snapshotter in list(self.snapshotters.values()):
+                try:
+                    snapshotter.write()
+                except Exception as e:
+                    print(f"Snapshot write of {snapshotter.portfolio_name} failed: {e}")
+
+    def _evict(self):
+        """
+        Removes the least recently used portfolios beyond max_portfolios, never the default one,
+        and marks them as closing. Must be called with the lock held.
+
+        Returns:
+            list: (name, portfolio, snapshotter or None) of the removed portfolios, to be closed.
+        """
+        evicted = []
+        for name in list(self.portfolios):
+            if len(self.portfolios) <= self.max_portfolios:
+                break
+            if name == self.portfolio_name:
+                continue
+            self.idempotency_stores.pop(name, None)
+            self.closing.add(name)
+            evicted.append((name, self.portfolios.pop(name), self.snapshotters.pop(name, None)))
+        return evicted
+
+    def _close(self, evicted):
+        """
+        Persists and closes evicted portfolios, outside the lock as it writes to Mongo and disk,
+        then lets requests waiting for them reopen them.
+        """
+        for name, portfolio, snapshotter in evicted:
+            try:
+                if snapshotter:
+                    snapshotter.write()
+                portfolio.close()
+            except Exception as e:
+                print(f"Closing portfolio {name} failed: {e}")
+            finally:
+                with self.lock:
+                    self.closing.discard(name)
+                    self.closed.notify_all()
+
+    def portfolio(self, name=None):
+        """
+        Returns the stock portfolio of a collection, creating it and its indexes on first use.
+        Callers serving reads check portfolio_exists first, so unknown portfolios are not created.
+
+        Args:
+            name (str): The portfolio name, the default portfolio if None. Must be a valid portfolio name.
+
+        Returns:
+            StockPortfolio: The portfolio.
+        """
+        name = name or self.portfolio_name
+        collection = self.db()[name]
+        evicted = []
+        with self.lock:
+            while name in self.closing:
+                self.closed.wait()
+            portfolio = self.portfolios.get(name)
+            if portfolio is None:
+                portfolio = self._create_portfolio(name, collection)
+                self.portfolios[name] = portfolio
+                evicted = self._evict()
+            else:
+                self.portfolios.move_to_end(name)
+        if evicted:
+            self._close(evicted)
+        try:
+            portfolio.ensure_indexes()
+        except Exception as e:
+            print(f"Index creation failed, will retry: {e}")
+        return portfolio
+
+    def idempotency_store(self, name=None):
+        """
+        Returns the store of Idempotency-Key responses of a portfolio, creating it on first use.
+
+        Args:
+            name (str): The portfolio name, the default portfolio if None.
+
+        Returns:
+            MemoryIdempotencyStore or MongoIdempotencyStore: The store, kept in "<portfolio>_idempotency" for Mongo.
+        """
+        name = name or self.portfolio_name
+        store = self.idempotency_stores.get(name)
+        if store is None:
+            if self.idempotency_store_type == 'memory':
+                store = MemoryIdempotencyStore(self.idempotency_ttl, self.idempotency_max_keys, self.idempotency_lease)
+            else:
+                store = MongoIdempotencyStore(self.db()[f"{name}_idempotency"], self.idempotency_ttl, self.idempotency_lease)
+            with self.lock:
+                store = self.idempotency_stores.setdefault(name, store)
+        return store
@@ -0,0 +1,131 @@
+import json
+import mmap
+import os
+import struct
+import threading
+
+
+class Snapshotter:
+    """
+    Persists the holdings read model of a portfolio to a local file, along with the shared price cache
+    for the default portfolio only, so a restarted service can serve warm traffic without rescanning
+    Mongo or refetching prices.
+    Snapshots are written periodically by the Services snapshot thread, shared by all portfolios.
+
+    File layout: 8-byte magic, 8-byte little-endian payload length, UTF-8 JSON payload.
+    The file is memory-mapped on load and only read the first time a cache asks for it.
+    """
+    MAGIC = b"STKSNAP1"
+    HEADER = struct.Struct("<8sQ")
+    FORMAT_VERSION = 1
+
+    def __init__(self, path, portfolio_name):
+        """
+        Args:
+            path (str): Location of the snapshot file.
+            portfolio_name (str): Name of the portfolio the snapshot belongs to.
+        """
+        self.path = path
+        self.portfolio_name = portfolio_name
+        self.portfolio = None
+        self.price_cache = None
+        self.loaded = None
+        self.last_written = None
+        self.load_lock = threading.Lock()
+        self.write_lock = threading.Lock()
+
+    def attach(self, portfolio, price_cache=None):
+        """
+        Registers the caches whose state is written to the snapshot.
+
+        Args:
+            portfolio (StockPortfolio): The portfolio owning the holdings read model.
+            price_cache (PriceCache): The price cache, only for the snapshot prices are warm-started from.
+        """
+        self.portfolio = portfolio
+        self.price_cache = price_cache
+
+    def _read(self):
+        """
+        Reads and validates the snapshot file once.
+
+        Returns:
+            dict: The snapshot payload, or an empty dict if the file is missing or invalid.
+        """
+        with self.load_lock:
+            if self.loaded is not None:
+                return self.loaded
+            self.loaded = {}
+            try:
+                with open(self.path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                    if len(mm) < self.HEADER.size:
+                        return self.loaded
+                    magic, length = self.HEADER.unpack_from(mm, 0)
+                    if magic != self.MAGIC or self.HEADER.size + length != len(mm):
+                        return self.loaded
+                    payload = json.loads(mm[self.HEADER.size:])
+            except FileNotFoundError:
+                return self.loaded
+            except (OSError, ValueError) as e:
+                print(f"Ignoring snapshot {self.path}: {e}")
+                return self.loaded
+            if payload.get("format") == self.FORMAT_VERSION and payload.get("portfolio") == self.portfolio_name:
+                self.loaded = payload
+            return self.loaded
+
+    def load_holdings(self):
+        """
+        Returns the persisted holdings read model.
+
+        Returns:
+            tuple: (portfolio version, list of stocks), or None if not in the snapshot.
+        """
+        holdings = self._read().get("holdings")
+        if not holdings:
+            return None
+        return holdings["version"], holdings["stocks"]
+
+    def load_prices(self):
+        """
+        Returns the persisted price cache entries.
+
+        Returns:
+            dict: {symbol: [price, fetched_at]}.
+        """
+        return self._read().get("prices", {})
+
+    def write(self):
+        """
+        Writes the current cache state to the snapshot file if it changed since the last write.
+        The file is replaced atomically so a crash never leaves a partial snapshot behind.
+
+        Returns:
+            bool: True if a snapshot was written, False if nothing changed.
+        """
+        with self.write_lock:
+            if self.portfolio is None:
+                return False
+            holdings = self.portfolio.holdings_state()
+            generation, prices = self.price_cache.snapshot() if self.price_cache is not None else (0, {})
+            state = (holdings[0] if holdings else None, generation)
+            if (holdings is None and generation == 0) or state == self.last_written:
+                return False
+            if holdings is None:
+                # Keep the holdings from the previous snapshot rather than dropping them.
+                holdings = self.load_holdings()
+            payload = {
+                "format": self.FORMAT_VERSION,
+                "portfolio": self.portfolio_name,
+                "holdings": {"version": holdings[0], "stocks": holdings[1]} if holdings else None,
+                "prices": prices,
+            }
+            data = json.dumps(payload, separators=(",", ":")).encode("utf-8")
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(self.HEADER.pack(self.MAGIC, len(data)))
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.last_written = state
+            return True
@@ -1,25 +1,365 @@
-from flask import Flask, jsonify, request, make_response
-import json
-import uuid
 import numbers
 import re
-from flask_restful import Resource, Api, reqparse
-import requests
-import os
-from datetime import datetime
-from flask_pymongo import PyMongo
-
+import threading
+import time
+import uuid
 
-API_KEY = os.getenv("NINJA_API_KEY")
+from common.holdings_index import HoldingsIndex
 
 class StockPortfolio:
     """
     Represents a stock portfolio that allows operations on stocks.
     Includes validation methods for stock attributes.
+
+    Keeps an in-memory read model of the holdings, stamped with the portfolio version
+    stored in the "<collection>_meta" collection. Every write bumps the version, so the
+    read model is only served while it matches the version in Mongo. The read model is
+    a HoldingsIndex, so query filters are answered from its secondary indexes.
+
+    In write-behind mode, updates are acknowledged once queued and flushed to Mongo
+    in batches; reads overlay the queued updates so writers see their own writes.
+
+    Every write is also appended to a change log in the "<collection>_changes" collection,
+    keyed by the portfolio version it produced, so consumers can sync incrementally.
+    Older changes of a stock are reduced to "superseded" stubs and the log keeps at most max_changes
+    entries; the version up to which changes are not served is kept in the "changes" meta document.
+    A version with no entry is a write still in flight, possibly in another process, so changes
+    are only served up to it, unless it stays missing for hole_timeout seconds.
     """
     STOCKS_FIELDS = ["id", "name", "symbol", "purchase price", "purchase date", "shares"]
-    def __init__(self, stocks_collection):
+    def __init__(self, stocks_collection, warm_start=None, max_changes=100000, hole_timeout=30):
+        """
+        Args:
+            stocks_collection (Collection): The Mongo collection holding the stocks.
+            warm_start (callable): Optional callable returning (version, list of stocks),
+                used once to seed the read model before falling back to a full scan.
+            max_changes (int): Maximum number of entries kept in the change log.
+            hole_timeout (float): Seconds a version may miss its change log entry before it is
+                considered lost, e.g. because its writer crashed, and consumers behind it resync.
+        """
         self.stocks = stocks_collection
+        self.meta = stocks_collection.database[f"{stocks_collection.name}_meta"]
+        self.changes = stocks_collection.database[f"{stocks_collection.name}_changes"]
+        self.max_changes = max_changes
+        self.hole_timeout = hole_timeout
+        # First time each missing change log entry was seen, by version
+        self.holes = {}
+        self.changes_started = False
+        # Held from a Mongo write until its version bump and read model update, so writes made by this
+        # process reach the read model in the order they reached Mongo
+        self.write_lock = threading.Lock()
+        self.warm_start = warm_start
+        self.holdings = None
+        self.holdings_version = None
+        self.holdings_lock = threading.Lock()
+        self.indexes_ensured = False
+        self.write_behind = None
+
+    def enable_write_behind(self, log_path, max_batch, flush_interval):
+        """
+        Switches stock updates to write-behind mode.
+
+        Args:
+            log_path (str): Location of the durability log.
+            max_batch (int): Number of pending stocks that triggers a flush.
+            flush_interval (float): Maximum seconds an update waits before being flushed.
+        """
+        from write_behind import WriteBehindQueue
+        self.write_behind = WriteBehindQueue(self.stocks, log_path, max_batch, flush_interval, self._record_flush)
+        self.write_behind.start()
+
+    def close(self):
+        """
+        Stops the write-behind queue, if any, after flushing its pending updates.
+        """
+        if self.write_behind is not None:
+            self.write_behind.stop()
+
+    def ensure_indexes(self):
+        """
+        Creates the indexes used by the symbol lookups and the change log compaction, once per portfolio.
+        """
+        if self.indexes_ensured:
+            return
+        self.stocks.create_index("symbol")
+        self.changes.create_index("id")
+        self.indexes_ensured = True
+
+    def portfolio_version(self):
+        """
+        Returns the current version of the portfolio.
+
+        Returns:
+            int: The number of writes applied to the portfolio (0 if never written).
+        """
+        doc = self.meta.find_one({"_id": "version"})
+        return doc["version"] if doc else 0
+
+    def content_version(self):
+        """
+        Returns a token that changes whenever the holdings served by this portfolio change,
+        including write-behind updates not yet flushed to Mongo.
+
+        Returns:
+            str: The portfolio version, followed by the write-behind sequence number if enabled.
+        """
+        version = self.portfolio_version()
+        if self.write_behind is None:
+            return str(version)
+        return f"{version}.{self.write_behind.seq}"
+
+    def _bump_version(self, count=1):
+        """
+        Increments the portfolio version.
+
+        Args:
+            count (int): Number of versions to allocate.
+
+        Returns:
+            int: The new portfolio version.
+        """
+        from pymongo import ReturnDocument
+        return self.meta.find_one_and_update(
+            {"_id": "version"}, {"$inc": {"version": count}}, upsert=True, return_document=ReturnDocument.AFTER
+        )["version"]
+
+    def _log_changes(self, changes):
+        """
+        Bumps the portfolio version by one per change and appends the changes to the change log.
+        Must be called with the write lock held.
+
+        Another process may write the same stocks between a Mongo write and its version bump, logging
+        them in the opposite order. So the stocks are read back once logged and logged again while they
+        differ, which leaves the latest entry of every stock matching Mongo.
+
+        Args:
+            changes (list): (stock ID, stock data or None if deleted) pairs, one per stock.
+
+        Returns:
+            int: The new portfolio version.
+        """
+        while changes:
+            version = self._bump_version(len(changes))
+            first = version - len(changes) + 1
+            if not self.changes_started:
+                # Versions before the first one logged may have no entry, they can only be served by a resync
+                self.meta.update_one({"_id": "changes"}, {"$setOnInsert": {"floor": first}}, upsert=True)
+                self.changes_started = True
+            ids = [id for id, stock in changes]
+            self.changes.insert_many([
+                {"_id": seq, "id": id, "op": "delete" if stock is None else "put", "stock": stock}
+                for seq, (id, stock) in enumerate(changes, start=first)
+            ])
+            # Older entries are kept as stubs, so a missing entry always means a write in flight
+            self.changes.update_many(
+                {"id": {"$in": ids}, "_id": {"$lt": first}, "op": {"$ne": "superseded"}},
+                {"$set": {"op": "superseded"}, "$unset": {"stock": ""}},
+            )
+            self._trim_changes()
+            current = {stock["id"]: stock for stock in self.stocks.find({"_id": {"$in": ids}}, {"_id": 0})}
+            changes = [(id, current.get(id)) for id, stock in changes if current.get(id) != stock]
+        return version
+
+    def _trim_changes(self):
+        """
+        Deletes the oldest change log entries beyond max_changes, raising the floor of the log first.
+        """
+        excess = self.changes.estimated_document_count() - self.max_changes
+        if excess > 0:
+            cutoff = next(self.changes.find({}, {"_id": 1}).sort("_id", 1).skip(excess - 1).limit(1))["_id"]
+            self.meta.update_one({"_id": "changes"}, {"$max": {"floor": cutoff}}, upsert=True)
+            self.changes.delete_many({"_id": {"$lte": cutoff}})
+
+    def _record_write(self, id, stock):
+        """
+        Logs a write, bumping the portfolio version, and applies the write to the read model.
+
+        Args:
+            id (str): The stock ID.
+            stock (dict): The stock data after the write, or None if it was deleted.
+        """
+        self._record_writes([(id, stock)])
+
+    def _record_writes(self, changes):
+        """
+        Logs a batch of writes, bumping the portfolio version once per stock, and applies them to the read model.
+
+        Args:
+            changes (list): (stock ID, stock data or None if deleted) pairs, one per stock.
+        """
+        version = self._log_changes(changes)
+        with self.holdings_lock:
+            if self.holdings is None or self.holdings_version != version - len(changes):
+                # Another writer got in between, rebuild on next read.
+                self.holdings = None
+                return
+            for id, stock in changes:
+                if stock is None:
+                    self.holdings.remove(id)
+                else:
+                    self.holdings.put(stock)
+            self.holdings_version = version
+
+    def _record_flush(self, batch):
+        """
+        Logs a write-behind batch that reached Mongo, bumping the portfolio version once per stock.
+        The read model already holds the batch, as it was applied when queued.
+
+        Args:
+            batch (dict): The flushed updates, {id: fields}.
+        """
+        with self.write_lock:
+            flushed = {stock["id"]: stock for stock in self.stocks.find({"_id": {"$in": list(batch)}}, {"_id": 0})}
+            if not flushed:
+                return
+            version = self._log_changes(list(flushed.items()))
+            with self.holdings_lock:
+                if self.holdings is None or self.holdings_version != version - len(flushed):
+                    self.holdings = None
+                    return
+                self.holdings_version = version
+
+    def _overlay_pending(self, stock, pending=None):
+        """
+        Applies the queued write-behind update of a stock, if any.
+
+        Args:
+            stock (dict): The stock data as stored in Mongo.
+            pending (dict): Optional snapshot of the queued updates, {id: fields}, for overlaying many stocks.
+
+        Returns:
+            dict: The stock data including its pending update.
+        """
+        if self.write_behind is None:
+            return stock
+        fields = pending.get(stock["id"]) if pending is not None else self.write_behind.pending_fields(stock["id"])
+        return {**stock, **fields} if fields else stock
+
+    def _symbol_taken(self, symbol, exclude_id=None):
+        """
+        Checks if another stock already holds a symbol, including queued updates.
+
+        Args:
+            symbol (str): The stock symbol.
+            exclude_id (str): The stock ID allowed to hold the symbol.
+
+        Returns:
+            bool: True if the symbol belongs to another stock, False otherwise.
+        """
+        if self.write_behind is None:
+            return self.stocks.find_one({"symbol": symbol, "_id": {"$ne": exclude_id}}) is not None
+        pending = self.write_behind.pending_updates()
+        if any(fields["symbol"] == symbol for id, fields in pending.items() if id != exclude_id):
+            return True
+        for stock in self.stocks.find({"symbol": symbol, "_id": {"$ne": exclude_id}}, {"_id": 1}):
+            if stock["_id"] not in pending or pending[stock["_id"]]["symbol"] == symbol:
+                return True
+        return False
+
+    def _current_holdings(self, filters=None):
+        """
+        Returns the holdings read model, rebuilding it if it is behind the portfolio version.
+
+        Args:
+            filters (dict): Optional query filters, see HoldingsIndex.query.
+
+        Returns:
+            list: The stocks in the portfolio matching the filters.
+        """
+        version = self.portfolio_version()
+        with self.holdings_lock:
+            return self._load_holdings(version).query(filters)
+
+    def _load_holdings(self, version):
+        """
+        Brings the read model to a portfolio version. Must be called with the holdings lock held.
+
+        Args:
+            version (int): The current portfolio version.
+
+        Returns:
+            HoldingsIndex: The read model.
+        """
+        if self.holdings is not None and self.holdings_version == version:
+            return self.holdings
+        pending = self.write_behind.pending_updates() if self.write_behind is not None else None
+        if self.warm_start is not None:
+            warm_start, self.warm_start = self.warm_start, None
+            snapshot = warm_start()
+            if snapshot and snapshot[0] == version:
+                self.holdings = HoldingsIndex(self._overlay_pending(stock, pending) for stock in snapshot[1])
+                self.holdings_version = version
+                return self.holdings
+        self.holdings = HoldingsIndex(self._overlay_pending(stock, pending) for stock in self.stocks.find({}, {'_id': 0}))
+        self.holdings_version = version
+        return self.holdings
+
+    def changes_since(self, since, limit):
+        """
+        Retrieves the changes made to the portfolio after a version, or all holdings
+        if the change log does not reach back to that version.
+        Changes are served up to the first version whose entry is still being written.
+        Write-behind updates are listed once flushed to Mongo.
+
+        Args:
+            since (int): The last portfolio version known to the caller.
+            limit (int): Maximum number of changes returned.
+
+        Returns:
+            tuple: (status code, {"seq", "resync", "more", "changes"} or, on resync, {"seq", "resync", "stocks"}).
+                "seq" is the version to pass as since on the next call, each change is
+                {"seq", "op" ("put" or "delete"), "id", "stock"}.
+        """
+        version = self.portfolio_version()
+        entries = list(self.changes.find({"_id": {"$gt": since, "$lte": version}}).sort("_id", 1).limit(limit + 1))
+        # Read after the entries, in case they were trimmed meanwhile
+        log = self.meta.find_one({"_id": "changes"})
+        if log is None or since < log["floor"] or since > version:
+            return self._resync(version)
+        seq = since
+        changes = []
+        for entry in entries[:limit]:
+            if entry["_id"] != seq + 1:
+                break
+            seq = entry["_id"]
+            if entry["op"] != "superseded":
+                changes.append({"seq": seq, "op": entry["op"], "id": entry["id"], "stock": entry["stock"]})
+        more = len(entries) > limit and seq == entries[limit - 1]["_id"]
+        hole = seq + 1 if not more and seq < version else None
+        for missing in [missing for missing in self.holes if since < missing <= seq or missing <= log["floor"]]:
+            self.holes.pop(missing, None)
+        if hole is not None and time.monotonic() - self.holes.setdefault(hole, time.monotonic()) > self.hole_timeout:
+            # The writer of this version is gone, consumers behind it can only catch up by a resync
+            self.meta.update_one({"_id": "changes"}, {"$max": {"floor": hole}})
+            self.holes.pop(hole, None)
+            return self._resync(version)
+        return 200, {"seq": seq, "resync": False, "more": more, "changes": changes}
+
+    def _resync(self, version):
+        """
+        Returns all holdings, for a consumer the change log cannot bring up to date.
+
+        Args:
+            version (int): The current portfolio version.
+
+        Returns:
+            tuple: (200, {"seq", "resync", "stocks"}).
+        """
+        with self.holdings_lock:
+            stocks = list(self._load_holdings(version).stocks.values())
+        return 200, {"seq": version, "resync": True, "stocks": stocks}
+
+    def holdings_state(self):
+        """
+        Returns the holdings read model for persisting.
+
+        Returns:
+            tuple: (portfolio version, list of stocks), or None if the read model is not loaded.
+        """
+        with self.holdings_lock:
+            if self.holdings is None:
+                return None
+            return self.holdings_version, list(self.holdings.stocks.values())
 
     def purchase_price_validation(self, purchase_price):
         """
@@ -92,7 +432,7 @@ class StockPortfolio:
             tuple: (status code, stock ID or -1 if insertion failed).
         """
         # Check if symbol already exists as a key
-        if self.stocks.find_one({"symbol": symbol}):  # CHANGED
+        if self._symbol_taken(symbol):  # CHANGED
             return 400, -1
         # The symbol already exists
         # Validate the fields
@@ -112,9 +452,79 @@ class StockPortfolio:
             'purchase date': purchase_date,
             'shares': shares,
         }
-        self.stocks.insert_one(stock_data)
+        with self.write_lock:
+            self.stocks.insert_one(stock_data)
+            stock_data.pop('_id')
+            self._record_write(stock_id, stock_data)
         return 201, stock_id
     
+    def insert_stocks(self, stocks):
+        """
+        Inserts a batch of stocks in one round trip, for bulk imports.
+        The batch is rejected as a whole if any stock is invalid, or if an ID or symbol is already taken.
+
+        Args:
+            stocks (list): The stocks, with at least symbol, shares and purchase price.
+                A missing ID is generated and a missing name or purchase date defaults to 'NA'.
+
+        Returns:
+            tuple: (status code, number of stocks inserted, 0 if the batch was rejected).
+        """
+        docs = []
+        for stock in stocks:
+            if set(stock) - set(self.STOCKS_FIELDS):
+                return 400, 0
+            symbol, shares, purchase_price = stock.get("symbol"), stock.get("shares"), stock.get("purchase price")
+            name, purchase_date = stock.get("name") or "NA", stock.get("purchase date") or "NA"
+            if not isinstance(symbol, str) or not symbol or not isinstance(shares, numbers.Integral):
+                return 400, 0
+            if not isinstance(name, str) or not isinstance(purchase_date, str):
+                return 400, 0
+            if not self.fields_validation(purchase_price, purchase_date, shares):
+                return 400, 0
+            stock_id = stock.get("id") or str(uuid.uuid4())
+            docs.append({
+                '_id': stock_id,
+                'id': stock_id,
+                'name': name,
+                'symbol': symbol.upper(),
+                'purchase price': purchase_price,
+                'purchase date': purchase_date,
+                'shares': int(shares),
+            })
+        if not docs:
+            return 201, 0
+        ids = [doc['_id'] for doc in docs]
+        symbols = [doc['symbol'] for doc in docs]
+        if len(set(ids)) < len(ids) or len(set(symbols)) < len(symbols):
+            return 400, 0
+        if self.stocks.find_one({"_id": {"$in": ids}}, {"_id": 1}) is not None:
+            return 400, 0
+        if self.write_behind is None:
+            if self.stocks.find_one({"symbol": {"$in": symbols}}, {"_id": 1}) is not None:
+                return 400, 0
+        elif any(self._symbol_taken(symbol) for symbol in symbols):
+            return 400, 0
+        with self.write_lock:
+            self.stocks.insert_many(docs)
+            for doc in docs:
+                doc.pop('_id')
+            self._record_writes([(doc['id'], doc) for doc in docs])
+        return 201, len(docs)
+
+    def export_stocks(self, batch_size):
+        """
+        Streams all stocks of the portfolio from Mongo, without loading the whole collection.
+
+        Args:
+            batch_size (int): Number of stocks fetched per round trip.
+
+        Returns:
+            generator: The stocks, including queued write-behind updates.
+        """
+        for stock in self.stocks.find({}, {'_id': 0}, batch_size=batch_size):
+            yield self._overlay_pending(stock)
+
     def retrieve_stocks(self):
         """
         Retrieves all stocks in the portfolio.
@@ -122,8 +532,20 @@ class StockPortfolio:
         Returns:
             tuple: (status code, dictionary of all stocks).
         """
-        stocks = list(self.stocks.find({}, {'_id': 0}))
-        return 200, stocks
+        return 200, self._current_holdings()
+
+    def query_stocks(self, filters):
+        """
+        Retrieves the stocks matching query filters, using the secondary indexes of the read model.
+
+        Args:
+            filters (dict): {field: value} filters; numsharesgt/numshareslt are int bounds on shares,
+                other fields are matched case-insensitively.
+
+        Returns:
+            tuple: (status code, list of matching stocks).
+        """
+        return 200, self._current_holdings(filters)
 
     def get_stock(self, id):
         """
@@ -137,7 +559,7 @@ class StockPortfolio:
         """
         stock = self.stocks.find_one({"_id": id}, {'_id': 0})
         if stock:
-            return 200, stock
+            return 200, self._overlay_pending(stock)
         return 404, None
 
     def delete_stock(self, id):
@@ -150,9 +572,13 @@ class StockPortfolio:
         Returns:
             tuple: (status code, deleted stock data or None if not found).
         """
-        result = self.stocks.delete_one({"_id": id})  # CHANGED
-        if result.deleted_count == 1:
-            return 204, None
+        with self.write_lock:
+            result = self.stocks.delete_one({"_id": id})  # CHANGED
+            if result.deleted_count == 1:
+                if self.write_behind is not None:
+                    self.write_behind.discard(id)
+                self._record_write(id, None)
+                return 204, None
         return 404, None
 
     def update_stock(self, id, name, symbol, purchase_price, purchase_date, shares):
@@ -169,28 +595,57 @@ class StockPortfolio:
 
         Returns:
             tuple: (status code, stock ID or -1 if update failed).
+                In write-behind mode a queued update returns (202, sequence number).
         """
         if not self.stock_exists(id):
             return 404, -1
-        symbol_conflict = self.stocks.find_one({"symbol": symbol, "_id": {"$ne": id}})
-        if symbol_conflict:
+        if self._symbol_taken(symbol, exclude_id=id):
             return 400, -1
         if not self.fields_validation(purchase_price = purchase_price, purchase_date = purchase_date, shares = shares):
             return 400, -1
-        update_result = self.stocks.update_one(
-            {"_id": id},
-            {
-                "$set": {
-                    "name": name,
-                    "symbol": symbol,
-                    "purchase price": round(float(purchase_price), 2),
-                    "purchase date": purchase_date,
-                    "shares": shares,
-                }
-            }
-        )
+        if self.write_behind is not None:
+            return 202, self._queue_update(id, name, symbol, purchase_price, purchase_date, shares)
+        from pymongo import ReturnDocument
+        with self.write_lock:
+            # The read model gets the stock as Mongo holds it after the update
+            updated = self.stocks.find_one_and_update(
+                {"_id": id},
+                {
+                    "$set": {
+                        "name": name,
+                        "symbol": symbol,
+                        "purchase price": round(float(purchase_price), 2),
+                        "purchase date": purchase_date,
+                        "shares": shares,
+                    }
+                },
+                projection={'_id': 0},
+                return_document=ReturnDocument.AFTER,
+            )
+            if updated is not None:
+                self._record_write(id, updated)
         return 200, id # Success - status code is 200
 
+    def _queue_update(self, id, name, symbol, purchase_price, purchase_date, shares):
+        """
+        Queues a validated update in write-behind mode and applies it to the read model.
+
+        Returns:
+            int: The sequence number acknowledging the update.
+        """
+        fields = {
+            "name": name,
+            "symbol": symbol,
+            "purchase price": round(float(purchase_price), 2),
+            "purchase date": purchase_date,
+            "shares": shares,
+        }
+        seq = self.write_behind.enqueue(id, fields)
+        with self.holdings_lock:
+            if self.holdings is not None and id in self.holdings.stocks:
+                self.holdings.put({**self.holdings.stocks[id], **fields})
+        return seq
+
     def stock_exists(self, id):
         """
         Checks if a stock exists by ID.
@@ -214,9 +669,10 @@ class StockPortfolio:
         Returns:
             tuple: (status code, stock symbol, ticker, calculated value).
         """
-        stock = self.stocks.find_one({"_id": id})
+        stock = self.stocks.find_one({"_id": id}, {'_id': 0})
         if not stock:
             return 404, None, None, None
+        stock = self._overlay_pending(stock)
         stock_symbol = stock['symbol']
         stock_shares = stock['shares']
         value = stock_shares * ticker
@@ -1,25 +1,62 @@
-from stock_portfolio import *
-from flask import Flask, jsonify, request, make_response
-import json
-import uuid
-import numbers
-import re
-from flask_restful import Resource, Api, reqparse
-import requests
-import os
+import hashlib
 from datetime import datetime
 
+from flask import Response, g, request, stream_with_context
+from flask_restful import Resource, reqparse
+
+import columnar
+from common.holdings_index import HoldingsIndex
+from common.jobs import JobQueueFull
+from common.price_source import PriceUnavailable
+
 
 class Stocks(Resource):
 
 
-    def __init__(self, portfolio):
-        self.portfolio = portfolio
+    def __init__(self, services):
+        self.portfolio = services.portfolio(g.portfolio_name)
+        self.idempotency = services.idempotency_store(g.portfolio_name)
 
     def post(self):
         """
         Handles the POST request to add a new stock to the portfolio.
 
+        With an Idempotency-Key header, the first response for the key is stored and replayed
+        to retries without validating or writing again. Reusing a key with a different payload
+        is rejected, as is a retry while the first request is still running.
+
+        Returns:
+            dict: A response containing the stock ID if created successfully.
+            int: HTTP status code (201 for success, 400 for malformed data,
+                409 if the key is in progress, 422 if the key was used for another payload).
+        """
+        key = request.headers.get('Idempotency-Key')
+        if not key:
+            return self.add_stock()
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        record = self.idempotency.begin(key, fingerprint)
+        if record is not None:
+            if record['fingerprint'] != fingerprint:
+                return {"error": "Idempotency-Key reused with a different payload"}, 422
+            if record['state'] != 'done':
+                return {"error": "A request with this Idempotency-Key is in progress"}, 409
+            return record['body'], record['status']
+        try:
+            body, status = self.add_stock()
+        except Exception:
+            self.idempotency.abandon(key)
+            raise
+        if status >= 500:
+            # Server errors are not final, let the client retry them
+            self.idempotency.abandon(key)
+        else:
+            self.idempotency.complete(key, status, body)
+        return body, status
+
+    def add_stock(self):
+        """
+        Validates the request payload and adds the stock to the portfolio.
+
         Returns:
             dict: A response containing the stock ID if created successfully.
             int: HTTP status code (201 for success, 400 for malformed data).
@@ -72,29 +109,137 @@ class Stocks(Resource):
     def get(self):
         """
         Handles the GET request to retrieve all stocks or filter stocks based on query parameters.
+        numsharesgt/numshareslt filter on a range of shares, other parameters on field equality.
 
         Returns:
             list: A list of stock dictionaries matching the query or all stocks.
-            int: HTTP status code (200 for success).
+            int: HTTP status code (200 for success, 400 for a malformed range).
         """
         try:
-            request_status, stocks = self.portfolio.retrieve_stocks()
             query_params = dict(request.args)
+            headers = {'X-Portfolio-Version': self.portfolio.content_version()}
             if not query_params:
-                return stocks, 200
-            filtered_stocks = [
-            stock for stock in stocks
-            if all(str(stock.get(field, "")).lower() == value.lower() for field, value in query_params.items())
-        ]
+                request_status, stocks = self.portfolio.retrieve_stocks()
+                return stocks, 200, headers
+            for field in HoldingsIndex.RANGE_FILTERS:
+                if field in query_params:
+                    try:
+                        query_params[field] = int(query_params[field])
+                    except ValueError:
+                        return {"error": "Malformed data"}, 400
+            request_status, filtered_stocks = self.portfolio.query_stocks(query_params)
         except Exception as e:
             return {"server error": str(e)}, 500
 
-        return filtered_stocks, 200
+        return filtered_stocks, 200, headers
+
+class StocksChanges(Resource):
+
+    def __init__(self, services):
+        self.portfolio = services.portfolio(g.portfolio_name)
+
+    def get(self):
+        """
+        Handles the GET request to retrieve the inserts, updates and deletes made after a portfolio version,
+        so consumers can keep a replica of the holdings without re-reading them all.
+
+        Query parameters:
+            since (int): The "seq" returned by the previous call, 0 on the first call.
+            limit (int): Maximum number of changes returned, 1000 by default. "more" is true if there are others.
+
+        Returns:
+            dict: {"seq", "resync": false, "more", "changes"}, or {"seq", "resync": true, "stocks"}
+                if the change log does not reach back to that version and the replica must be replaced.
+            int: HTTP status code (200 for success, 400 for a malformed since or limit).
+        """
+        try:
+            since = int(request.args.get('since', '0'))
+            limit = int(request.args.get('limit', '1000'))
+        except ValueError:
+            return {"error": "Malformed data"}, 400
+        if since < 0 or limit < 1:
+            return {"error": "Malformed data"}, 400
+        try:
+            request_status, changes = self.portfolio.changes_since(since, limit)
+        except Exception as e:
+            return {"server error": str(e)}, 500
+        return changes, request_status
+
+class StocksExport(Resource):
+
+    def __init__(self, services):
+        self.portfolio = services.portfolio(g.portfolio_name)
+
+    def get(self):
+        """
+        Handles the GET request to stream all stocks as an Arrow IPC stream or a Parquet file,
+        one record batch at a time.
+
+        Query parameters:
+            format (str): "arrow" (default) or "parquet".
+            batch_size (int): Number of stocks per record batch, 10000 by default.
+
+        Returns:
+            Response: The streamed stocks, with the X-Portfolio-Version they were read at.
+            int: HTTP status code (200 for success, 400 for malformed parameters, 501 without pyarrow).
+        """
+        fmt = request.args.get('format', 'arrow')
+        try:
+            batch_size = int(request.args.get('batch_size', '10000'))
+        except ValueError:
+            return {"error": "Malformed data"}, 400
+        if fmt not in columnar.FORMATS or batch_size < 1:
+            return {"error": "Malformed data"}, 400
+        try:
+            columnar.schema()
+        except columnar.MissingPyArrow as e:
+            return {"error": str(e)}, 501
+        headers = {'X-Portfolio-Version': self.portfolio.content_version()}
+        chunks = columnar.stream_export(self.portfolio.export_stocks(batch_size), fmt, batch_size)
+        return Response(stream_with_context(chunks), mimetype=columnar.FORMATS[fmt], headers=headers)
+
+class StocksImport(Resource):
+
+    def __init__(self, services):
+        self.portfolio = services.portfolio(g.portfolio_name)
+
+    def post(self):
+        """
+        Handles the POST request to add the stocks of an Arrow IPC stream or a Parquet file to the portfolio,
+        with one bulk insert per record batch. The stocks must not reuse existing IDs or symbols.
+
+        Query parameters:
+            format (str): "arrow" (default) or "parquet".
+            batch_size (int): Maximum number of stocks per bulk insert, 10000 by default.
+
+        Returns:
+            dict: The number of stocks imported, with the resulting portfolio version.
+            int: HTTP status code (201 for success, 400 for malformed data, 501 without pyarrow).
+                Batches before a malformed one stay imported, and are counted in the error response.
+        """
+        fmt = request.args.get('format', 'arrow')
+        try:
+            batch_size = int(request.args.get('batch_size', '10000'))
+        except ValueError:
+            return {"error": "Malformed data"}, 400
+        if fmt not in columnar.FORMATS or batch_size < 1:
+            return {"error": "Malformed data"}, 400
+        try:
+            # Parquet keeps its metadata in a footer, so the body must be seekable
+            source = columnar.spool(request.stream) if fmt == 'parquet' else request.stream
+            imported = columnar.import_batches(self.portfolio, columnar.read_batches(source, fmt, batch_size))
+        except columnar.MissingPyArrow as e:
+            return {"error": str(e)}, 501
+        except columnar.ImportRejected as e:
+            return {"error": "Malformed data", "imported": e.imported}, 400
+        except Exception as e:
+            return {"server error": str(e)}, 500
+        return {"imported": imported, "seq": self.portfolio.portfolio_version()}, 201
 
 class StocksID(Resource):
     
-    def __init__(self, portfolio):
-        self.portfolio = portfolio
+    def __init__(self, services):
+        self.portfolio = services.portfolio(g.portfolio_name)
 
     """
     Handles operations for specific stocks by ID at the '/stocks/<id>' endpoint.
@@ -154,6 +299,9 @@ class StocksID(Resource):
         request_status, stock = self.portfolio.update_stock(id, name, symbol, purchase_price, purchase_date, shares)
         if request_status == 200:
             return {'id': id}, 200
+        elif request_status == 202:
+            # Write-behind mode: queued durably, acknowledged with its sequence number
+            return {'id': id, 'seq': stock}, 202
         elif request_status == 400:
             return {"error": "Malformed data"}, request_status
         elif request_status == 404:
@@ -198,11 +346,11 @@ class StocksID(Resource):
         except Exception as e:
             return {"server error": str(e)}, 500
 
-API_KEY = 'T6x6QsSBjaxT+BssCEg4VQ==wwU7bHC7P9hlXitc'
 class stockValueID(Resource):
 
-    def __init__(self, portfolio):
-        self.portfolio = portfolio
+    def __init__(self, services):
+        self.portfolio = services.portfolio(g.portfolio_name)
+        self.price_source = services.price_source
 
     """
     Handles operations for retrieving the current value of a specific stock by ID at the '/stock-value/<id>' endpoint.
@@ -216,7 +364,7 @@ class stockValueID(Resource):
 
         Returns:
             dict: The stock symbol, ticker, and calculated value if successful.
-            int: HTTP status code (200 for success, 404 if not found, 500 for server error).
+            int: HTTP status code (200 for success, 404 if not found, 503 if no price is available, 500 for server error).
         """
         try:
             if not self.portfolio.stock_exists(id):  # CHANGED
@@ -224,14 +372,12 @@ class stockValueID(Resource):
 
             stock = self.portfolio.get_stock(id)[1]
             symbol = stock['symbol']
-            url = 'https://api.api-ninjas.com/v1/stockprice?ticker={}'.format(symbol)
-            response = requests.get(url, headers={'X-Api-Key': API_KEY})
-            print(f"External API status: {response.status_code}")
-            print(f"External API response: {response.text}")
-            data = response.json()
-            if not data:
+            quote = self.price_source.quote(symbol)
+            if quote is None:
                 return {"error": "Not found"}, 404
-            price_per_stock = data['price']
+            price_per_stock = quote['price']
+        except PriceUnavailable as e:
+            return {"error": str(e)}, 503
         except Exception as e:
             return {"server error": str(e)}, 500
         request_status, stock_symbol, ticker, value = self.portfolio.stock_value(id=id, ticker=price_per_stock)
@@ -239,7 +385,9 @@ class stockValueID(Resource):
             return {
                 "symbol": stock_symbol,
                 "ticker": ticker,
-                "stock value": value
+                "stock value": value,
+                "as_of": quote['as_of'],
+                "stale": quote['stale']
             }, 200
         if request_status == 404:
             return {"error": "Not found"}, 404
@@ -247,8 +395,9 @@ class stockValueID(Resource):
 
 class portfolioValue(Resource):
 
-    def __init__(self, portfolio):
-        self.portfolio = portfolio
+    def __init__(self, services):
+        self.portfolio = services.portfolio(g.portfolio_name)
+        self.price_source = services.price_source
 
     """
     Handles operations for retrieving the total value of the portfolio at the '/portfolio-value' endpoint.
@@ -258,31 +407,119 @@ class portfolioValue(Resource):
         """
         Handles the GET request to calculate the total value of the portfolio using live stock data.
 
+        While the price source is failing, last known prices are used and flagged as stale.
+
+        Returns:
+            dict: The total portfolio value, the current date and the price used per symbol.
+            int: HTTP status code (200 for success, 503 if no price is available, 500 for server error).
+        """
+        try:
+            request_status, stocks = self.portfolio.retrieve_stocks()
+            return compute_portfolio_value(stocks, self.price_source)
+        except Exception as e:
+            return {"server error": str(e)}, 500
+
+
+def compute_portfolio_value(stocks, price_source, progress=None, batch_size=None):
+    """
+    Calculates the total value of a portfolio using live stock data.
+
+    Args:
+        stocks (list): The stocks of the portfolio.
+        price_source (PriceSource): The source of current prices.
+        progress (callable): Optional callback receiving {"priced", "total", "prices"} after each batch of symbols.
+        batch_size (int): Number of symbols priced per batch, all at once if None.
+
+    Returns:
+        dict: The total portfolio value, the current date and the price used per symbol.
+        int: HTTP status code (200 for success, 404 if a stock is unknown, 503 if no price is available).
+    """
+    if not stocks:
+        return {"error": "No stocks found"}, 404
+    symbols = list(dict.fromkeys(stock['symbol'] for stock in stocks))
+    batch_size = batch_size or len(symbols)
+    prices = {}
+    try:
+        for start in range(0, len(symbols), batch_size):
+            prices.update(price_source.quotes(symbols[start:start + batch_size]))
+            if progress:
+                progress({"priced": len(prices), "total": len(symbols), "prices": dict(prices)})
+    except PriceUnavailable as e:
+        return {"error": str(e)}, 503
+    portfolio_value = 0
+    for stock in stocks:
+        quote = prices[stock['symbol']]
+        if quote is None:
+            return {"error": "Not found"}, 404
+        num_of_shares = stock['shares']
+        portfolio_value += quote['price']*num_of_shares
+
+    current_date = datetime.now()
+    formatted_date = current_date.strftime("%d-%m-%Y")
+
+    return {
+        "date": formatted_date,
+        "portfolio value": portfolio_value,
+        "stale": any(quote['stale'] for quote in prices.values()),
+        "prices": prices}, 200
+
+
+class portfolioValueJob(Resource):
+
+    def __init__(self, services):
+        self.portfolio = services.portfolio(g.portfolio_name)
+        self.price_source = services.price_source
+        self.jobs = services.jobs
+        self.job_batch = services.job_batch
+        self.portfolio_name = g.portfolio_name or services.portfolio_name
+
+    """
+    Starts background valuations of the portfolio at the '/jobs/portfolio-value' endpoint.
+    """
+    def post(self):
+        """
+        Handles the POST request to start valuing the portfolio in the background.
+        Valuations are memoized per portfolio version, so repeated requests share one job.
+
         Returns:
-            dict: The total portfolio value and the current date.
-            int: HTTP status code (200 for success, 500 for server error).
+            dict: The job ID and state.
+            int: HTTP status code (202 for accepted, 503 if too many jobs are pending, 500 for server error).
         """
-        portfolio_value = 0
         try:
+            version = self.portfolio.content_version()
             request_status, stocks = self.portfolio.retrieve_stocks()
-            if request_status == 404 or not stocks:
-                return {"error": "No stocks found"}, 404
-            for stock in stocks:
-                url = 'https://api.api-ninjas.com/v1/stockprice?ticker={}'.format(stock['symbol'])
-                response = requests.get(url, headers={'X-Api-Key': API_KEY})
-                data = response.json()
-                if not data:
-                    return {"error": "Not found"}, 404
-                price_per_stock = data['price']
-                num_of_shares = stock['shares']
-                portfolio_value += price_per_stock*num_of_shares
+            job = self.jobs.submit(
+                "portfolio-value",
+                ("portfolio-value", self.portfolio_name, version),
+                lambda progress: compute_portfolio_value(stocks, self.price_source, progress, self.job_batch),
+            )
+        except JobQueueFull as e:
+            return {"error": str(e)}, 503
         except Exception as e:
             return {"server error": str(e)}, 500
+        return {"id": job.id, "state": job.state}, 202, {"Location": f"/jobs/{job.id}"}
+
 
-        current_date = datetime.now()
-        formatted_date = current_date.strftime("%d-%m-%Y")
+class jobID(Resource):
 
-        return {
-            "date": formatted_date,
-            "portfolio value": portfolio_value}, 200
+    def __init__(self, services):
+        self.jobs = services.jobs
 
+    """
+    Handles operations for background jobs by ID at the '/jobs/<id>' endpoint.
+    """
+    def get(self, id):
+        """
+        Handles the GET request to report the progress and result of a job.
+
+        Args:
+            id (str): The job ID.
+
+        Returns:
+            dict: The job state, its progress (symbols priced so far) and, once done, its result.
+            int: HTTP status code (200 for success, 404 if not found).
+        """
+        job = self.jobs.get(id)
+        if job is None:
+            return {"error": "Not found"}, 404
+        return job.to_dict(), 200
@@ -0,0 +1,268 @@
+import json
+import os
+import threading
+
+
+class WriteBehindQueue:
+    """
+    Buffers stock updates in memory and flushes them to Mongo in bulk batches.
+
+    Updates to the same stock are coalesced, so only its latest fields are written.
+    Every acknowledged update is first appended to a durability log (fsynced), which is
+    replayed on startup, so a crash never loses an acknowledged update. Replaying is safe
+    because each update is an idempotent $set of the full stock. Concurrent updates share
+    one fsync, taken outside the queue lock, and the log is rewritten after each flush outside
+    the lock too, so reads do not wait on the disk.
+
+    A batch stays in the log until on_flush has reported it, and a failed on_flush is retried
+    on the next flush without writing the batch again.
+    """
+    # Rounds of copying the updates enqueued during a log rewrite, before the last ones are copied under the lock
+    REWRITE_ROUNDS = 3
+
+    def __init__(self, collection, log_path, max_batch, flush_interval, on_flush):
+        """
+        Args:
+            collection (Collection): The Mongo collection holding the stocks.
+            log_path (str): Location of the durability log.
+            max_batch (int): Number of pending stocks that triggers a flush.
+            flush_interval (float): Maximum seconds an update waits before being flushed.
+            on_flush (callable): Called with {id: fields} after a batch reached Mongo.
+                Updates of failed calls are passed again to the next call.
+        """
+        self.stocks = collection
+        self.log_path = log_path
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.on_flush = on_flush
+        self.seq = 0
+        self.pending = {}
+        self.inflight = {}
+        self.unreported = {}
+        self.synced_seq = 0
+        self.lock = threading.Lock()
+        self.sync_lock = threading.Lock()
+        self.flush_lock = threading.Lock()
+        self.flush_event = threading.Event()
+        self.stop_event = threading.Event()
+        self.recover()
+        self.log = open(self.log_path, "a", encoding="utf-8")
+
+    def recover(self):
+        """
+        Loads the updates left in the durability log by a previous process into the queue.
+        """
+        try:
+            with open(self.log_path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn last line was never acknowledged
+                        continue
+                    self.seq = max(self.seq, entry["seq"])
+                    if "id" in entry:
+                        self.pending[entry["id"]] = entry["fields"]
+        except FileNotFoundError:
+            pass
+        self.synced_seq = self.seq
+
+    def _append(self, entry):
+        """
+        Writes an entry to the log, without syncing it. Must be called with the lock held.
+        """
+        self.log.write(json.dumps(entry, separators=(",", ":")) + "\n")
+        self.log.flush()
+
+    def _sync(self, seq):
+        """
+        Makes the log durable up to a sequence number, with one fsync for every entry appended meanwhile.
+
+        Args:
+            seq (int): The sequence number that must be durable.
+        """
+        with self.sync_lock:
+            if self.synced_seq >= seq:
+                return
+            with self.lock:
+                log, target = self.log, self.seq
+            try:
+                os.fsync(log.fileno())
+            except (ValueError, OSError):
+                # A rewrite replaced the log meanwhile, and fsynced the entry in the new one
+                if not log.closed:
+                    raise
+            self.synced_seq = max(self.synced_seq, target)
+
+    def enqueue(self, id, fields):
+        """
+        Durably records an update and queues it for the next flush.
+
+        Args:
+            id (str): The stock ID.
+            fields (dict): The fields to set on the stock.
+
+        Returns:
+            int: The sequence number acknowledging the update.
+        """
+        with self.lock:
+            self.seq += 1
+            seq = self.seq
+            self._append({"seq": seq, "id": id, "fields": fields})
+            self.pending[id] = fields
+            if len(self.pending) >= self.max_batch:
+                self.flush_event.set()
+        self._sync(seq)
+        return seq
+
+    def discard(self, id):
+        """
+        Drops the pending update of a stock, e.g. after it was deleted.
+
+        Args:
+            id (str): The stock ID.
+        """
+        with self.lock:
+            self.pending.pop(id, None)
+
+    def pending_fields(self, id):
+        """
+        Returns the not yet flushed fields of a stock.
+
+        Args:
+            id (str): The stock ID.
+
+        Returns:
+            dict: The pending fields, or None if the stock has no pending update.
+        """
+        with self.lock:
+            return self.pending.get(id, self.inflight.get(id))
+
+    def pending_updates(self):
+        """
+        Returns all updates not yet flushed to Mongo.
+
+        Returns:
+            dict: {id: fields}.
+        """
+        with self.lock:
+            return {**self.inflight, **self.pending}
+
+    def _rewrite_log(self):
+        """
+        Replaces the log with the updates still pending or unreported.
+        The new log is written and fsynced outside the lock, then the updates enqueued meanwhile
+        are copied over, until none were and the logs can be swapped under the lock.
+        Must be called with the flush lock held, so unreported updates do not change meanwhile.
+        """
+        tmp_path = f"{self.log_path}.tmp"
+        written = {}
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for attempt in range(self.REWRITE_ROUNDS):
+                with self.lock:
+                    seq = self.seq
+                    entries = self._unwritten(written)
+                if attempt == 0:
+                    f.write(json.dumps({"seq": seq}) + "\n")
+                self._write_entries(f, seq, entries)
+                written.update(entries)
+                f.flush()
+                os.fsync(f.fileno())
+                with self.lock:
+                    if self.seq != seq and attempt < self.REWRITE_ROUNDS - 1:
+                        continue
+                    if self.seq != seq:
+                        # Updates keep coming, copy the last ones under the lock
+                        self._write_entries(f, self.seq, self._unwritten(written))
+                        f.flush()
+                        os.fsync(f.fileno())
+                    os.replace(tmp_path, self.log_path)
+                    self.log.close()
+                    self.log = open(self.log_path, "a", encoding="utf-8")
+                    self.synced_seq = max(self.synced_seq, self.seq)
+                    return
+
+    def _unwritten(self, written):
+        """
+        Returns the pending or unreported updates not yet written to a new log. Must be called with the lock held.
+
+        Args:
+            written (dict): The updates written so far, {id: fields}.
+
+        Returns:
+            dict: {id: fields}.
+        """
+        return {id: fields for id, fields in {**self.unreported, **self.pending}.items() if written.get(id) is not fields}
+
+    @staticmethod
+    def _write_entries(f, seq, entries):
+        for id, fields in entries.items():
+            f.write(json.dumps({"seq": seq, "id": id, "fields": fields}, separators=(",", ":")) + "\n")
+
+    def flush(self):
+        """
+        Writes the pending updates to Mongo as one unordered bulk write, then reports them
+        to on_flush along with the updates of previously failed reports.
+
+        Returns:
+            int: The number of stocks written.
+        """
+        from pymongo import UpdateOne
+        with self.flush_lock:
+            with self.lock:
+                if not self.pending and not self.unreported:
+                    return 0
+                self.inflight, self.pending = self.pending, {}
+            batch = self.inflight
+            if batch:
+                try:
+                    self.stocks.bulk_write(
+                        [UpdateOne({"_id": id}, {"$set": fields}) for id, fields in batch.items()], ordered=False
+                    )
+                except Exception:
+                    with self.lock:
+                        # Keep newer updates queued meanwhile, retry the rest on the next flush
+                        self.pending = {**batch, **self.pending}
+                        self.inflight = {}
+                    raise
+                with self.lock:
+                    # In Mongo now, but kept in the log until reported
+                    self.unreported.update(batch)
+                    self.inflight = {}
+            try:
+                self.on_flush(dict(self.unreported))
+                with self.lock:
+                    self.unreported = {}
+            finally:
+                self._rewrite_log()
+            return len(batch)
+
+    def _run(self):
+        while not self.stop_event.is_set():
+            self.flush_event.wait(self.flush_interval)
+            self.flush_event.clear()
+            if self.stop_event.is_set():
+                break
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Write-behind flush failed, will retry: {e}")
+
+    def start(self):
+        """
+        Starts the background thread flushing on the size or time trigger.
+        """
+        threading.Thread(target=self._run, name="write-behind", daemon=True).start()
+
+    def stop(self):
+        """
+        Stops the background thread, flushes what is still pending and closes the log.
+        Updates that could not be flushed stay in the log, to be recovered by the next queue.
+        """
+        self.stop_event.set()
+        self.flush_event.set()
+        try:
+            self.flush()
+        finally:
+            with self.lock:
+                self.log.close()
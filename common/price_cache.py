@@ -0,0 +1,87 @@
+import threading
+import time
+
+
+class PriceCache:
+    """
+    In-memory cache of the last known price per stock symbol.
+    Entries older than the TTL are not served as fresh prices.
+    """
+    def __init__(self, ttl, warm_start=None):
+        """
+        Args:
+            ttl (float): Number of seconds a fetched price is considered fresh.
+            warm_start (callable): Optional callable returning {symbol: [price, fetched_at]},
+                invoked lazily on first access to seed the cache.
+        """
+        self.ttl = ttl
+        self.warm_start = warm_start
+        self.prices = {}
+        self.generation = 0
+        self.lock = threading.Lock()
+
+    def _ensure_loaded(self):
+        """
+        Seeds the cache from the warm start source the first time it is used.
+        Must be called with the lock held.
+        """
+        if self.warm_start is None:
+            return
+        warm_start, self.warm_start = self.warm_start, None
+        for symbol, (price, fetched_at) in (warm_start() or {}).items():
+            self.prices.setdefault(symbol, (price, fetched_at))
+
+    def get(self, symbol):
+        """
+        Returns the cached price of a symbol if it is still fresh.
+
+        Args:
+            symbol (str): The stock symbol.
+
+        Returns:
+            float: The cached price, or None if missing or expired.
+        """
+        with self.lock:
+            self._ensure_loaded()
+            entry = self.prices.get(symbol)
+        if entry is None or time.time() - entry[1] > self.ttl:
+            return None
+        return entry[0]
+
+    def last_known(self, symbol):
+        """
+        Returns the last fetched price of a symbol, however old.
+
+        Args:
+            symbol (str): The stock symbol.
+
+        Returns:
+            tuple: (price, fetched_at), or None if the symbol was never fetched.
+        """
+        with self.lock:
+            self._ensure_loaded()
+            return self.prices.get(symbol)
+
+    def put(self, symbol, price):
+        """
+        Stores a freshly fetched price for a symbol.
+
+        Args:
+            symbol (str): The stock symbol.
+            price (float): The current price per share.
+        """
+        with self.lock:
+            self._ensure_loaded()
+            self.prices[symbol] = (price, time.time())
+            self.generation += 1
+
+    def snapshot(self):
+        """
+        Returns a copy of all cached entries for persisting.
+
+        Returns:
+            tuple: (generation, {symbol: [price, fetched_at]}).
+        """
+        with self.lock:
+            self._ensure_loaded()
+            return self.generation, {symbol: list(entry) for symbol, entry in self.prices.items()}
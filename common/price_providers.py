@@ -0,0 +1,183 @@
+import json
+import os
+import random
+import threading
+import time
+
+
+class PriceProvider:
+    """
+    Source of current stock prices.
+    Subclasses implement get_price, and override get_prices and set batched when the backend
+    supports multi-ticker queries.
+    """
+    # True if get_prices answers all symbols in one upstream call, False if it makes one call per symbol
+    batched = False
+
+    def get_price(self, symbol):
+        """
+        Returns the current price of a symbol.
+
+        Args:
+            symbol (str): The stock symbol.
+
+        Returns:
+            float: The price per share, or None if the provider does not know the symbol.
+        """
+        raise NotImplementedError
+
+    def get_prices(self, symbols):
+        """
+        Returns the current prices of several symbols. A symbol whose fetch failed does not fail the others.
+
+        Args:
+            symbols (list): The stock symbols.
+
+        Returns:
+            dict: {symbol: price, None if the provider does not know the symbol, or the exception raised fetching it}.
+        """
+        prices = {}
+        for symbol in symbols:
+            try:
+                prices[symbol] = self.get_price(symbol)
+            except Exception as e:
+                prices[symbol] = e
+        return prices
+
+
+class ApiNinjasProvider(PriceProvider):
+    """
+    Prices from the api-ninjas stockprice API, which answers one ticker per request.
+    """
+    URL = 'https://api.api-ninjas.com/v1/stockprice?ticker={}'
+
+    def __init__(self, api_key, timeout):
+        """
+        Args:
+            api_key (str): The api-ninjas API key.
+            timeout (float): Seconds to wait for the API.
+        """
+        self.api_key = api_key
+        self.timeout = timeout
+
+    def get_price(self, symbol):
+        import requests
+        response = requests.get(self.URL.format(symbol), headers={'X-Api-Key': self.api_key}, timeout=self.timeout)
+        response.raise_for_status()
+        data = response.json()
+        if not data:
+            return None
+        return data['price']
+
+
+class SimulatedProviderError(ConnectionError):
+    """
+    Raised by the simulator to mimic an upstream failure.
+    """
+
+
+class SimulatedProvider(PriceProvider):
+    """
+    Local price simulator for load tests: every symbol follows its own random walk.
+    The walks and the injected errors are derived from the seed, so a given sequence
+    of calls always produces the same prices.
+    """
+    batched = True
+
+    def __init__(self, seed=0, latency=0.0, error_rate=0.0, volatility=0.01):
+        """
+        Args:
+            seed (int): Seed of the random walks and of the error injection.
+            latency (float): Seconds every call takes.
+            error_rate (float): Probability in [0, 1] that a call fails.
+            volatility (float): Standard deviation of the relative price change per call.
+        """
+        self.seed = seed
+        self.latency = latency
+        self.error_rate = error_rate
+        self.volatility = volatility
+        self.errors = random.Random(seed)
+        self.walks = {}
+        self.lock = threading.Lock()
+
+    def _step(self, symbol):
+        """
+        Advances the random walk of a symbol. Must be called with the lock held.
+        """
+        if symbol not in self.walks:
+            rng = random.Random(f"{self.seed}:{symbol}")
+            self.walks[symbol] = (rng, rng.uniform(10, 500))
+        rng, price = self.walks[symbol]
+        price = max(0.01, price * (1 + rng.gauss(0, self.volatility)))
+        self.walks[symbol] = (rng, price)
+        return round(price, 2)
+
+    def _call(self, symbols):
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            if self.errors.random() < self.error_rate:
+                raise SimulatedProviderError("Simulated price API failure")
+            return {symbol: self._step(symbol) for symbol in symbols}
+
+    def get_price(self, symbol):
+        return self._call([symbol])[symbol]
+
+    def get_prices(self, symbols):
+        # The simulator answers a whole batch in one call, like a multi-ticker API
+        return self._call(symbols)
+
+
+class ReplayProvider(PriceProvider):
+    """
+    Replays prices recorded in a file of JSON lines, e.g. {"symbol": "AAPL", "price": 183.63}.
+    Each symbol cycles through its recorded prices in file order.
+    """
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Location of the recorded prices.
+        """
+        self.prices = {}
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self.prices.setdefault(entry["symbol"].upper(), []).append(entry["price"])
+        self.positions = {}
+        self.lock = threading.Lock()
+
+    def get_price(self, symbol):
+        prices = self.prices.get(symbol)
+        if not prices:
+            return None
+        with self.lock:
+            position = self.positions.get(symbol, 0)
+            self.positions[symbol] = position + 1
+        return prices[position % len(prices)]
+
+
+def provider_from_env():
+    """
+    Builds the price provider selected by the PRICE_PROVIDER environment variable.
+
+    PRICE_PROVIDER=api-ninjas (default): NINJA_API_KEY, PRICE_TIMEOUT.
+    PRICE_PROVIDER=simulator: SIM_SEED, SIM_LATENCY, SIM_ERROR_RATE, SIM_VOLATILITY.
+    PRICE_PROVIDER=replay: PRICE_REPLAY_FILE.
+
+    Returns:
+        PriceProvider: The configured provider.
+    """
+    name = os.getenv('PRICE_PROVIDER', 'api-ninjas')
+    if name == 'api-ninjas':
+        return ApiNinjasProvider(os.getenv('NINJA_API_KEY'), float(os.getenv('PRICE_TIMEOUT', '3')))
+    if name == 'simulator':
+        return SimulatedProvider(
+            seed=int(os.getenv('SIM_SEED', '0')),
+            latency=float(os.getenv('SIM_LATENCY', '0')),
+            error_rate=float(os.getenv('SIM_ERROR_RATE', '0')),
+            volatility=float(os.getenv('SIM_VOLATILITY', '0.01')),
+        )
+    if name == 'replay':
+        return ReplayProvider(os.environ['PRICE_REPLAY_FILE'])
+    raise ValueError(f"Unknown PRICE_PROVIDER {name!r}")
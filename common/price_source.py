@@ -0,0 +1,118 @@
+from datetime import datetime, timezone
+
+
+class PriceUnavailable(Exception):
+    """
+    Raised when a price can neither be fetched nor served from the last known prices.
+    """
+    def __init__(self, symbol):
+        super().__init__(f"No price available for {symbol}")
+        self.symbol = symbol
+
+
+class PriceSource:
+    """
+    Serves prices from the cache while fresh, fetches them from the provider through a circuit
+    breaker otherwise, and falls back to the last known price when the provider is failing.
+    """
+    def __init__(self, provider, cache, breaker):
+        """
+        Args:
+            provider (PriceProvider): The source of current prices.
+            cache (PriceCache): The cache of fetched prices.
+            breaker (CircuitBreaker): The circuit breaker guarding the provider.
+        """
+        self.provider = provider
+        self.cache = cache
+        self.breaker = breaker
+
+    @staticmethod
+    def _quote(price, fetched_at, stale):
+        return {
+            "price": price,
+            "as_of": datetime.fromtimestamp(fetched_at, timezone.utc).isoformat(timespec="seconds"),
+            "stale": stale,
+        }
+
+    def quote(self, symbol):
+        """
+        Returns the price of a symbol along with its freshness.
+
+        Args:
+            symbol (str): The stock symbol.
+
+        Returns:
+            dict: {"price", "as_of", "stale"}, or None if the provider does not know the symbol.
+
+        Raises:
+            PriceUnavailable: If the provider is failing and the symbol has no last known price.
+        """
+        return self.quotes([symbol])[symbol]
+
+    def _fetch(self, symbols):
+        """
+        Makes one upstream call through the circuit breaker and records its outcome.
+
+        Args:
+            symbols (list): The stock symbols.
+
+        Returns:
+            dict: {symbol: price or None if unknown} for the symbols fetched, empty if the circuit is open.
+        """
+        if not self.breaker.allow():
+            return {}
+        try:
+            results = self.provider.get_prices(symbols)
+        except Exception as e:
+            results = {symbol: e for symbol in symbols}
+        prices = {}
+        for symbol, result in results.items():
+            if isinstance(result, Exception):
+                print(f"Price fetch for {symbol} failed: {result}")
+            else:
+                prices[symbol] = result
+        if prices or not results:
+            self.breaker.record_success()
+        else:
+            self.breaker.record_failure()
+        return prices
+
+    def quotes(self, symbols):
+        """
+        Returns the prices of several symbols, fetching the cache misses in one provider batch if the provider
+        supports it, one symbol per call otherwise. Prices fetched before a failure are kept and cached.
+
+        Args:
+            symbols (list): The stock symbols.
+
+        Returns:
+            dict: {symbol: {"price", "as_of", "stale"}, or None if the provider does not know the symbol}.
+
+        Raises:
+            PriceUnavailable: If the provider is failing and a symbol has no last known price.
+        """
+        quotes = {}
+        missing = []
+        for symbol in dict.fromkeys(symbols):
+            if self.cache.get(symbol) is not None:
+                quotes[symbol] = self._quote(*self.cache.last_known(symbol), stale=False)
+            else:
+                missing.append(symbol)
+        calls = [missing] if self.provider.batched else [[symbol] for symbol in missing]
+        for call in calls:
+            if not call:
+                continue
+            for symbol, price in self._fetch(call).items():
+                if price is not None:
+                    self.cache.put(symbol, price)
+                    quotes[symbol] = self._quote(*self.cache.last_known(symbol), stale=False)
+                else:
+                    quotes[symbol] = None
+        for symbol in missing:
+            if symbol in quotes:
+                continue
+            last_known = self.cache.last_known(symbol)
+            if last_known is None:
+                raise PriceUnavailable(symbol)
+            quotes[symbol] = self._quote(*last_known, stale=True)
+        return quotes
@@ -0,0 +1,150 @@
+import hmac
+import math
+import os
+import sys
+import threading
+import time
+from collections import Counter
+
+# Request dispatch frames, which would otherwise fill the per-request report
+FRAMEWORK_PACKAGES = ("flask", "flask_restful", "werkzeug")
+
+
+class SamplingProfiler:
+    """
+    Samples the stacks of running threads at a fixed interval, for a bounded duration,
+    and aggregates them in the collapsed-stack format read by flamegraph tools:
+    one "frame;frame;frame count" line per distinct stack, outermost frame first.
+    Only one profile runs at a time.
+    """
+    def __init__(self, thread_ids=None):
+        """
+        Args:
+            thread_ids (set): Optional live set of the IDs of the threads to sample, e.g. those
+                handling a request, so parked server and worker threads do not fill the profile.
+                All threads are sampled if None.
+        """
+        self.thread_ids = thread_ids
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def _frame_name(frame):
+        code = frame.f_code
+        return f"{os.path.basename(code.co_filename)}:{code.co_name}"
+
+    def sample(self, duration, interval):
+        """
+        Profiles the live threads of the process.
+
+        Args:
+            duration (float): Seconds to sample for.
+            interval (float): Seconds between two samples.
+
+        Returns:
+            str: The collapsed stacks, or None if another profile is already running.
+        """
+        if not self.lock.acquire(blocking=False):
+            return None
+        try:
+            stacks = Counter()
+            own_thread = threading.get_ident()
+            deadline = time.monotonic() + duration
+            while time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id == own_thread or (self.thread_ids is not None and thread_id not in self.thread_ids):
+                        continue
+                    names = []
+                    while frame is not None:
+                        names.append(self._frame_name(frame))
+                        frame = frame.f_back
+                    stacks[";".join(reversed(names))] += 1
+                time.sleep(interval)
+            return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+        finally:
+            self.lock.release()
+
+
+def install_profiling(app, admin_token=None, top_n=None, max_seconds=None):
+    """
+    Adds the profiling hooks to a Flask app, enabled only when an admin token is configured.
+
+    GET /admin/profile?seconds=<s>&interval=<s> samples the threads handling requests and returns collapsed stacks.
+    Any request sent with "X-Profile: 1" is run under cProfile, and its top_n hottest functions
+    by own time, outside of Flask and werkzeug, are returned in the X-Profile-Top header and logged.
+    Both require the admin token in the X-Admin-Token header.
+
+    Args:
+        app (Flask): The app.
+        admin_token (str): The admin token, ADMIN_TOKEN by default. Profiling is disabled without it.
+        top_n (int): Number of functions reported per profiled request, PROFILE_TOP_N (10) by default.
+        max_seconds (float): Longest sampling profile allowed, PROFILE_MAX_SECONDS (60) by default.
+    """
+    from flask import Response, abort, g, request
+
+    admin_token = admin_token or os.getenv('ADMIN_TOKEN')
+    top_n = top_n or int(os.getenv('PROFILE_TOP_N', '10'))
+    max_seconds = max_seconds or float(os.getenv('PROFILE_MAX_SECONDS', '60'))
+    # Threads currently handling a request, the only ones the sampling profiler records
+    request_threads = set()
+    profiler = SamplingProfiler(request_threads)
+    framework_dirs = tuple(f"{os.sep}{package}{os.sep}" for package in FRAMEWORK_PACKAGES)
+
+    def authorized():
+        token = request.headers.get('X-Admin-Token', '')
+        return bool(admin_token) and hmac.compare_digest(token.encode(), admin_token.encode())
+
+    def profile():
+        if not admin_token:
+            abort(404)
+        if not authorized():
+            return {"error": "Unauthorized"}, 401
+        try:
+            seconds = float(request.args.get('seconds', '10'))
+            interval = float(request.args.get('interval', '0.01'))
+        except ValueError:
+            return {"error": "Malformed data"}, 400
+        if not (math.isfinite(seconds) and math.isfinite(interval) and seconds > 0 and interval > 0):
+            return {"error": "Malformed data"}, 400
+        seconds, interval = min(seconds, max_seconds), max(interval, 0.001)
+        collapsed = profiler.sample(seconds, interval)
+        if collapsed is None:
+            return {"error": "A profile is already running"}, 409
+        return Response(collapsed, mimetype='text/plain')
+
+    app.add_url_rule('/admin/profile', view_func=profile, methods=['GET'])
+
+    @app.before_request
+    def track_request_thread():
+        request_threads.add(threading.get_ident())
+
+    @app.teardown_request
+    def untrack_request_thread(exc):
+        request_threads.discard(threading.get_ident())
+
+    @app.before_request
+    def start_request_profile():
+        if request.headers.get('X-Profile') == '1' and authorized():
+            import cProfile
+            g.request_profile = cProfile.Profile()
+            g.request_profile.enable()
+
+    @app.after_request
+    def report_request_profile(response):
+        request_profile = g.pop('request_profile', None)
+        if request_profile is None:
+            return response
+        request_profile.disable()
+        import pstats
+        stats = pstats.Stats(request_profile).sort_stats(pstats.SortKey.TIME)
+        hot = []
+        for (filename, lineno, function) in stats.fcn_list:
+            if len(hot) == top_n:
+                break
+            if any(framework_dir in filename for framework_dir in framework_dirs):
+                continue
+            own_time = stats.stats[(filename, lineno, function)][2]
+            hot.append(f"{os.path.basename(filename)}:{lineno}({function}) {own_time * 1000:.1f}ms")
+        summary = "; ".join(hot)
+        print(f"Profile {request.method} {request.path}: {summary}")
+        response.headers['X-Profile-Top'] = summary
+        return response
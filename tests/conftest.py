@@ -0,0 +1,16 @@
+"""
+Unit tests of the services' building blocks. They run on mongomock and need no running services:
+
+    pip install -r requirements-dev.txt
+    pytest tests
+
+assn4_tests.py holds the end-to-end tests run by the CI pipeline against the containers.
+"""
+import os
+import sys
+
+# The services import their modules by name, as they run from their own directory
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (ROOT, os.path.join(ROOT, "StocksService")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
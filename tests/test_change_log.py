@@ -0,0 +1,90 @@
+import time
+
+import mongomock
+import pytest
+
+from stock_portfolio import StockPortfolio
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+def insert(portfolio, symbol, shares=1):
+    status, id = portfolio.insert_stock(symbol.lower(), symbol, 1.0, "NA", shares)
+    assert status == 201
+    return id
+
+
+def test_data_written_before_the_log_is_resynced(db):
+    db.stocks.insert_one({"_id": "old", "id": "old", "name": "old", "symbol": "OLD", "purchase price": 1.0, "purchase date": "NA", "shares": 1})
+    portfolio = StockPortfolio(db.stocks)
+    status, page = portfolio.changes_since(0, 10)
+    assert page["resync"] and [s["id"] for s in page["stocks"]] == ["old"]
+
+    insert(portfolio, "AAA")
+    status, page = portfolio.changes_since(0, 10)
+    assert page["resync"] and len(page["stocks"]) == 2
+
+
+def test_changes_are_paged_from_since(db):
+    portfolio = StockPortfolio(db.stocks)
+    ids = [insert(portfolio, symbol) for symbol in ("AAA", "BBB", "CCC")]
+    status, page = portfolio.changes_since(1, 1)
+    assert not page["resync"] and page["more"]
+    assert [(c["seq"], c["id"]) for c in page["changes"]] == [(2, ids[1])]
+    status, page = portfolio.changes_since(page["seq"], 10)
+    assert [(c["seq"], c["id"]) for c in page["changes"]] == [(3, ids[2])]
+    assert page["seq"] == 3 and not page["more"]
+
+
+def test_older_changes_of_a_stock_are_superseded(db):
+    portfolio = StockPortfolio(db.stocks)
+    id = insert(portfolio, "AAA")
+    insert(portfolio, "BBB")
+    portfolio.update_stock(id, "a", "AAA", 2.0, "NA", 7)
+    portfolio.delete_stock(id)
+    status, page = portfolio.changes_since(1, 10)
+    assert [(c["seq"], c["op"]) for c in page["changes"]] == [(2, "put"), (4, "delete")]
+    assert page["seq"] == 4
+    assert db.stocks_changes.count_documents({"op": "superseded"}) == 2
+
+
+def test_trimmed_log_resyncs_consumers_behind_it(db):
+    portfolio = StockPortfolio(db.stocks, max_changes=2)
+    for symbol in ("AAA", "BBB", "CCC", "DDD"):
+        insert(portfolio, symbol)
+    assert db.stocks_changes.count_documents({}) == 2
+    status, page = portfolio.changes_since(1, 10)
+    assert page["resync"] and page["seq"] == 4 and len(page["stocks"]) == 4
+    status, page = portfolio.changes_since(2, 10)
+    assert not page["resync"] and [c["seq"] for c in page["changes"]] == [3, 4]
+
+
+def test_feed_stops_at_a_version_still_being_logged(db):
+    portfolio = StockPortfolio(db.stocks, hole_timeout=0.05)
+    insert(portfolio, "AAA")
+    # Another process allocated version 2 and has not logged it yet
+    portfolio._bump_version()
+    insert(portfolio, "BBB")
+    status, page = portfolio.changes_since(1, 10)
+    assert page["seq"] == 1 and page["changes"] == [] and not page["more"]
+
+    time.sleep(0.1)
+    status, page = portfolio.changes_since(1, 10)
+    assert page["resync"] and page["seq"] == 3
+    status, page = portfolio.changes_since(page["seq"], 10)
+    assert not page["resync"] and page["changes"] == []
+
+
+def test_latest_entry_matches_mongo_after_an_out_of_order_write(db):
+    portfolio = StockPortfolio(db.stocks)
+    id = insert(portfolio, "AAA")
+    stale = db.stocks.find_one({"_id": id}, {"_id": 0})
+    # Another process wrote shares=9 to Mongo, then its version was allocated before ours
+    db.stocks.update_one({"_id": id}, {"$set": {"shares": 9}})
+    with portfolio.write_lock:
+        portfolio._log_changes([(id, stale)])
+    status, page = portfolio.changes_since(1, 10)
+    assert page["changes"][-1]["stock"]["shares"] == 9
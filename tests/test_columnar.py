@@ -0,0 +1,76 @@
+import io
+import os
+
+import mongomock
+import pymongo
+import pytest
+
+pytest.importorskip("pyarrow")
+
+import columnar
+from stock_portfolio import StockPortfolio
+
+
+def stocks(count, start=0):
+    return [
+        {"id": f"id{i}", "name": f"Stock {i}", "symbol": f"S{i}", "purchase price": 1.5 + i, "purchase date": "NA", "shares": i}
+        for i in range(start, start + count)
+    ]
+
+
+@pytest.fixture
+def portfolio():
+    return StockPortfolio(mongomock.MongoClient().db.stocks)
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_stream_round_trip(fmt, portfolio):
+    data = b"".join(columnar.stream_export(stocks(25), fmt, batch_size=10))
+    assert columnar.import_batches(portfolio, columnar.read_batches(io.BytesIO(data), fmt, batch_size=7)) == 25
+    assert sorted(portfolio.retrieve_stocks()[1], key=lambda s: s["shares"]) == stocks(25)
+
+
+@pytest.mark.parametrize("fmt", ["arrow", "parquet"])
+def test_file_round_trip_with_slices(fmt, tmp_path):
+    path = str(tmp_path / f"stocks.{fmt}")
+    assert columnar.export_to_file(stocks(12), fmt, path, batch_size=5) == 12
+    batches = list(columnar.read_batches(path, fmt, batch_size=4))
+    assert max(batch.num_rows for batch in batches) <= 4
+    assert [row for batch in batches for row in batch.to_pylist()] == stocks(12)
+
+
+def test_rejected_batch_keeps_earlier_batches(portfolio):
+    taken = stocks(1, start=3)[0]
+    portfolio.insert_stocks([{**taken, "id": "other"}])
+    data = b"".join(columnar.stream_export(stocks(6), "arrow", batch_size=3))
+    with pytest.raises(columnar.ImportRejected) as rejected:
+        # The second batch reuses the symbol S3
+        columnar.import_batches(portfolio, columnar.read_batches(io.BytesIO(data), "arrow", batch_size=3))
+    assert rejected.value.imported == 3
+    assert len(portfolio.retrieve_stocks()[1]) == 4
+
+
+def test_truncated_stream_is_rejected(portfolio):
+    data = b"".join(columnar.stream_export(stocks(6), "arrow", batch_size=3))
+    with pytest.raises(columnar.ImportRejected):
+        columnar.import_batches(portfolio, columnar.read_batches(io.BytesIO(data[:-200]), "arrow", batch_size=3))
+
+
+def test_cli_leaves_the_server_state_alone(monkeypatch, tmp_path):
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(pymongo, "MongoClient", lambda *args, **kwargs: client)
+    monkeypatch.setenv("PRICE_PROVIDER", "simulator")
+    monkeypatch.setenv("SNAPSHOT_PATH", str(tmp_path / "{portfolio}.snapshot"))
+    monkeypatch.setenv("WRITE_BEHIND", "1")
+    monkeypatch.setenv("WRITE_BEHIND_LOG", str(tmp_path / "{portfolio}.wal"))
+    path = str(tmp_path / "stocks.parquet")
+    columnar.export_to_file(stocks(5), "parquet", path, batch_size=2)
+
+    assert columnar.main(["import", "--portfolio", "restored", path]) == 0
+    assert client["stocks_db"]["restored"].count_documents({}) == 5
+    exported = str(tmp_path / "exported.arrow")
+    assert columnar.main(["export", "--portfolio", "restored", exported]) == 0
+    assert [row for batch in columnar.read_batches(exported, "arrow", 10) for row in batch.to_pylist()] == stocks(5)
+    assert sorted(os.listdir(tmp_path)) == ["exported.arrow", "stocks.parquet"]
+    with pytest.raises(SystemExit):
+        columnar.main(["export", "--portfolio", "missing", exported])
@@ -0,0 +1,43 @@
+from common.holdings_index import HoldingsIndex
+
+
+def stock(id, symbol, shares, name=None):
+    return {"id": id, "name": name or symbol, "symbol": symbol, "purchase price": 1.0, "purchase date": "NA", "shares": shares}
+
+
+def test_query_by_shares_range_and_symbol():
+    index = HoldingsIndex([stock("a", "AAA", 5), stock("b", "BBB", 10), stock("c", "CCC", 15)])
+    assert [s["id"] for s in index.query({"numsharesgt": 5, "numshareslt": 15})] == ["b"]
+    assert [s["id"] for s in index.query({"symbol": "ccc"})] == ["c"]
+    assert [s["id"] for s in index.query(None)] == ["a", "b", "c"]
+
+
+def test_put_replaces_a_stock_and_reindexes_it():
+    index = HoldingsIndex([stock("a", "AAA", 5), stock("b", "BBB", 10)])
+    index.put(stock("a", "ZZZ", 20))
+    assert index.query({"symbol": "AAA"}) == []
+    assert [s["id"] for s in index.query({"numsharesgt": 15})] == ["a"]
+    # Replaced stocks keep their position
+    assert [s["id"] for s in index.query(None)] == ["a", "b"]
+
+
+def test_remove_unindexes_a_stock():
+    index = HoldingsIndex([stock("a", "AAA", 5), stock("b", "BBB", 5)])
+    index.remove("a")
+    index.remove("missing")
+    assert len(index) == 1
+    assert [s["id"] for s in index.query({"numsharesgt": 1})] == ["b"]
+    assert index.query({"symbol": "AAA"}) == []
+
+
+def test_stocks_sharing_name_and_shares_are_updated_and_removed_individually():
+    index = HoldingsIndex(stock(f"id{i}", f"S{i}", 10, name="NA") for i in range(100))
+    index.put(stock("id50", "S50", 20, name="Renamed"))
+    index.remove("id7")
+    assert len(index.query({"name": "na"})) == 98
+    assert [s["id"] for s in index.query({"name": "renamed"})] == ["id50"]
+    assert [s["id"] for s in index.query({"numsharesgt": 10})] == ["id50"]
+    assert len(index.query({"shares": "10"})) == 98
+    assert "id7" not in [s["id"] for s in index.query({"numshareslt": 11})]
+    # Stocks keep their first position among equal names and shares
+    assert [s["id"] for s in index.query({"name": "NA", "numshareslt": 11})][:8] == [f"id{i}" for i in (0, 1, 2, 3, 4, 5, 6, 8)]
@@ -0,0 +1,40 @@
+import time
+
+import mongomock
+import pytest
+
+from idempotency import MemoryIdempotencyStore, MongoIdempotencyStore
+
+
+@pytest.fixture(params=["memory", "mongo"])
+def store(request):
+    if request.param == "memory":
+        return MemoryIdempotencyStore(3600, 100, lease=0.05)
+    return MongoIdempotencyStore(mongomock.MongoClient().db.stocks_idempotency, 3600, lease=0.05)
+
+
+def test_completed_key_is_replayed(store):
+    assert store.begin("k", "f1") is None
+    store.complete("k", 201, {"id": "x"})
+    record = store.begin("k", "f1")
+    assert (record["state"], record["status"], record["body"]) == ("done", 201, {"id": "x"})
+
+
+def test_reused_key_keeps_its_fingerprint(store):
+    assert store.begin("k", "f1") is None
+    store.complete("k", 201, {"id": "x"})
+    assert store.begin("k", "f2")["fingerprint"] == "f1"
+
+
+def test_pending_key_conflicts_until_its_lease_lapses(store):
+    assert store.begin("k", "f1") is None
+    assert store.begin("k", "f1")["state"] == "pending"
+    time.sleep(0.1)
+    assert store.begin("k", "f1") is None
+    assert store.begin("k", "f1")["state"] == "pending"
+
+
+def test_abandoned_key_can_be_retried(store):
+    assert store.begin("k", "f1") is None
+    store.abandon("k")
+    assert store.begin("k", "f1") is None
@@ -0,0 +1,71 @@
+import threading
+import time
+
+import pytest
+
+from common.jobs import JobManager, JobQueueFull
+
+
+def wait_finished(job):
+    deadline = time.monotonic() + 5
+    while not job.finished_at and time.monotonic() < deadline:
+        time.sleep(0.01)
+
+
+def test_same_key_is_memoized():
+    jobs = JobManager(2, 10, 60)
+    calls = []
+
+    def compute(progress):
+        calls.append(1)
+        return {"value": 1}, 200
+
+    job = jobs.submit("value", ("k", 1), compute)
+    wait_finished(job)
+    assert jobs.submit("value", ("k", 1), compute) is job
+    other = jobs.submit("value", ("k", 2), compute)
+    wait_finished(other)
+    assert other is not job
+    assert job.state == "done" and job.result == {"value": 1}
+    assert len(calls) == 2
+
+
+def test_failed_jobs_are_not_memoized():
+    jobs = JobManager(1, 10, 60)
+
+    def compute(progress):
+        raise RuntimeError("upstream down")
+
+    job = jobs.submit("value", "k", compute)
+    wait_finished(job)
+    assert job.state == "failed"
+    assert jobs.submit("value", "k", compute) is not job
+
+
+def test_finished_jobs_expire():
+    jobs = JobManager(1, 10, 0.01)
+    job = jobs.submit("value", "k", lambda progress: ({}, 200))
+    wait_finished(job)
+    time.sleep(0.02)
+    assert jobs.get(job.id) is None
+    assert jobs.submit("value", "k", lambda progress: ({}, 200)) is not job
+
+
+def test_queue_is_bounded():
+    jobs = JobManager(1, 1, 60)
+    release = threading.Event()
+    jobs.submit("value", "a", lambda progress: (release.wait(5), 200))
+    with pytest.raises(JobQueueFull):
+        jobs.submit("value", "b", lambda progress: ({}, 200))
+    release.set()
+
+
+def test_jobs_answering_a_server_error_are_not_memoized():
+    jobs = JobManager(1, 10, 60)
+    job = jobs.submit("value", "k", lambda progress: ({"error": "No price available for AAPL"}, 503))
+    wait_finished(job)
+    assert job.state == "done" and job.status == 503
+    retried = jobs.submit("value", "k", lambda progress: ({"value": 1}, 200))
+    wait_finished(retried)
+    assert retried is not job and retried.status == 200
+    assert jobs.submit("value", "k", lambda progress: ({}, 200)) is retried
@@ -0,0 +1,88 @@
+import threading
+
+import mongomock
+import pymongo
+import pytest
+
+from common.price_providers import SimulatedProvider
+from services import Services
+
+STOCK = {"symbol": "AAPL", "purchase price": 100.0, "shares": 5}
+
+
+@pytest.fixture
+def services(monkeypatch, tmp_path):
+    monkeypatch.setattr(pymongo, "MongoClient", mongomock.MongoClient)
+    return Services(
+        "mongodb://unused", "stocks_db", "stocks1a", str(tmp_path / "{portfolio}.snapshot"), 3600, 60,
+        write_behind_log=str(tmp_path / "{portfolio}.wal"), price_provider=SimulatedProvider(), max_portfolios=2,
+    )
+
+
+@pytest.fixture
+def client(services):
+    from run import create_app
+    return create_app(services).test_client()
+
+
+def test_portfolios_are_routed_by_path_and_header(client, services):
+    assert client.post("/portfolios/p1/stocks", json=STOCK).status_code == 201
+    assert client.post("/stocks", headers={"X-Portfolio": "p2"}, json={**STOCK, "symbol": "MSFT"}).status_code == 201
+    assert [s["symbol"] for s in client.get("/portfolios/p1/stocks").get_json()] == ["AAPL"]
+    assert [s["symbol"] for s in client.get("/stocks", headers={"X-Portfolio": "p2"}).get_json()] == ["MSFT"]
+    assert client.get("/stocks").get_json() == []
+    assert services.db()["p1"].count_documents({}) == 1
+
+
+def test_unknown_portfolios_are_404_and_create_nothing(client, services):
+    assert client.get("/portfolios/zzz/stocks").status_code == 404
+    assert client.get("/stocks", headers={"X-Portfolio": "zzz"}).status_code == 404
+    assert client.get("/portfolios/zzz/stocks/changes").status_code == 404
+    assert client.get("/portfolios/bad.name/stocks").status_code == 404
+    assert client.post("/portfolios/zzz_meta/stocks", json=STOCK).status_code == 404
+    assert services.db().list_collection_names() == []
+    assert list(services.portfolios) == []
+
+
+def test_least_recently_used_portfolio_is_evicted_after_flushing(client, services):
+    for name in ("p1", "p2"):
+        assert client.post(f"/portfolios/{name}/stocks", json=STOCK).status_code == 201
+    p1 = services.portfolio("p1")
+    id = p1.retrieve_stocks()[1][0]["id"]
+    assert p1.update_stock(id, "Apple", "AAPL", 100.0, "NA", 9)[0] == 202
+    client.get("/portfolios/p2/stocks")
+
+    assert client.post("/portfolios/p3/stocks", json=STOCK).status_code == 201
+    assert list(services.portfolios) == ["p2", "p3"]
+    assert services.db()["p1"].find_one({"_id": id})["shares"] == 9
+    # Evicted portfolios are still served, from a new instance
+    assert client.get("/portfolios/p1/stocks").get_json()[0]["shares"] == 9
+
+
+def test_evicted_portfolio_is_not_reopened_until_closed(services):
+    services.portfolio("p1")
+    evicted = services.portfolio("p1")
+    closing, release = threading.Event(), threading.Event()
+    close = evicted.close
+
+    def slow_close():
+        closing.set()
+        release.wait(5)
+        close()
+
+    evicted.close = slow_close
+    services.portfolio("p2")
+    evicting = threading.Thread(target=services.portfolio, args=("p3",))
+    evicting.start()
+    assert closing.wait(5)
+
+    reopened = []
+    reopening = threading.Thread(target=lambda: reopened.append(services.portfolio("p1")))
+    reopening.start()
+    reopening.join(0.2)
+    assert reopened == []
+    release.set()
+    evicting.join(5)
+    reopening.join(5)
+    assert reopened[0] is not evicted
+    assert evicted.write_behind.log.closed and not reopened[0].write_behind.log.closed
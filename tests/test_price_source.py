@@ -0,0 +1,87 @@
+import pytest
+
+from common.circuit_breaker import CircuitBreaker
+from common.price_cache import PriceCache
+from common.price_providers import PriceProvider, ReplayProvider, SimulatedProvider, SimulatedProviderError
+from common.price_source import PriceSource, PriceUnavailable
+
+
+class FakeProvider(PriceProvider):
+    """
+    Answers from a dict of prices; symbols in failing raise, and every call is recorded.
+    """
+    def __init__(self, prices, failing=(), batched=False):
+        self.prices = prices
+        self.failing = set(failing)
+        self.batched = batched
+        self.calls = []
+
+    def get_price(self, symbol):
+        if symbol in self.failing:
+            raise ConnectionError(f"{symbol} failed")
+        return self.prices.get(symbol)
+
+    def get_prices(self, symbols):
+        self.calls.append(list(symbols))
+        return super().get_prices(symbols)
+
+
+def source(provider, ttl=60, threshold=3):
+    return PriceSource(provider, PriceCache(ttl), CircuitBreaker(threshold, 60))
+
+
+def test_partial_batch_keeps_the_prices_that_were_fetched():
+    provider = FakeProvider({"A": 1.0, "B": 2.0}, failing=["BAD"], batched=True)
+    prices = source(provider)
+    with pytest.raises(PriceUnavailable) as raised:
+        prices.quotes(["A", "BAD", "B"])
+    assert raised.value.symbol == "BAD"
+    assert prices.cache.get("A") == 1.0 and prices.cache.get("B") == 2.0
+    assert prices.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_unbatched_provider_is_called_once_per_missing_symbol():
+    provider = FakeProvider({"A": 1.0, "B": 2.0})
+    prices = source(provider)
+    prices.quotes(["A"])
+    quotes = prices.quotes(["A", "B", "UNKNOWN"])
+    assert provider.calls == [["A"], ["B"], ["UNKNOWN"]]
+    assert quotes["B"]["price"] == 2.0 and not quotes["B"]["stale"]
+    assert quotes["UNKNOWN"] is None
+
+
+def test_breaker_counts_each_failed_upstream_call():
+    provider = FakeProvider({}, failing=["A", "B", "C"])
+    prices = source(provider, threshold=3)
+    with pytest.raises(PriceUnavailable):
+        prices.quotes(["A", "B", "C"])
+    assert prices.breaker.state == CircuitBreaker.OPEN
+
+
+def test_stale_price_is_served_while_the_provider_fails():
+    provider = FakeProvider({"A": 1.0})
+    prices = source(provider, ttl=-1)
+    prices.quotes(["A"])
+    provider.failing.add("A")
+    quote = prices.quote("A")
+    assert quote["price"] == 1.0 and quote["stale"]
+
+
+def test_simulator_is_deterministic_per_seed():
+    first, second = SimulatedProvider(seed=7), SimulatedProvider(seed=7)
+    walk = [first.get_prices(["A", "B"]) for _ in range(5)]
+    assert walk == [second.get_prices(["A", "B"]) for _ in range(5)]
+    assert walk != [SimulatedProvider(seed=8).get_prices(["A", "B"]) for _ in range(5)]
+
+
+def test_simulator_injects_errors_at_its_error_rate():
+    with pytest.raises(SimulatedProviderError):
+        SimulatedProvider(error_rate=1.0).get_prices(["A"])
+
+
+def test_replay_cycles_through_recorded_prices(tmp_path):
+    path = tmp_path / "prices.jsonl"
+    path.write_text('{"symbol": "aapl", "price": 1.0}\n\n{"symbol": "AAPL", "price": 2.0}\n', encoding="utf-8")
+    provider = ReplayProvider(str(path))
+    assert [provider.get_price("AAPL") for _ in range(3)] == [1.0, 2.0, 1.0]
+    assert provider.get_price("MSFT") is None
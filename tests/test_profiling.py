@@ -0,0 +1,62 @@
+import threading
+import time
+
+import pytest
+from flask import Flask
+
+from common.profiling import install_profiling
+
+
+def busy_handler():
+    deadline = time.monotonic() + 0.5
+    while time.monotonic() < deadline:
+        sum(range(1000))
+    return "done"
+
+
+def make_app(admin_token="secret"):
+    app = Flask(__name__)
+    app.add_url_rule("/busy", view_func=busy_handler)
+    install_profiling(app, admin_token=admin_token)
+    return app
+
+
+def test_profiling_is_disabled_without_a_token():
+    client = make_app(admin_token=None).test_client()
+    assert client.get("/admin/profile").status_code == 404
+    assert "X-Profile-Top" not in client.get("/busy", headers={"X-Profile": "1"}).headers
+
+
+def test_profiling_requires_the_admin_token():
+    client = make_app().test_client()
+    assert client.get("/admin/profile", headers={"X-Admin-Token": "wrong"}).status_code == 401
+    assert "X-Profile-Top" not in client.get("/busy", headers={"X-Profile": "1", "X-Admin-Token": "wrong"}).headers
+
+
+@pytest.mark.parametrize("query", ["seconds=nan", "seconds=0", "seconds=-1", "interval=inf", "interval=0", "seconds=x"])
+def test_sampling_rejects_invalid_durations(query):
+    client = make_app().test_client()
+    assert client.get(f"/admin/profile?{query}", headers={"X-Admin-Token": "secret"}).status_code == 400
+
+
+def test_profile_top_lists_handler_frames_only():
+    client = make_app().test_client()
+    top = client.get("/busy", headers={"X-Profile": "1", "X-Admin-Token": "secret"}).headers["X-Profile-Top"]
+    assert "busy_handler" in top
+    assert "app.py" not in top and "serving.py" not in top
+
+
+def test_sampling_records_request_threads_only():
+    app = make_app()
+    parked = threading.Event()
+    idle = threading.Thread(target=parked.wait, name="idle")
+    idle.start()
+    busy = threading.Thread(target=lambda: app.test_client().get("/busy"))
+    busy.start()
+    time.sleep(0.05)
+    collapsed = app.test_client().get("/admin/profile?seconds=0.2&interval=0.01", headers={"X-Admin-Token": "secret"}).get_data(as_text=True)
+    parked.set()
+    busy.join()
+    idle.join()
+    assert "busy_handler" in collapsed
+    assert all("busy_handler" in line for line in collapsed.splitlines())
@@ -0,0 +1,81 @@
+import mongomock
+import pytest
+
+from common.price_cache import PriceCache
+from snapshot import Snapshotter
+from stock_portfolio import StockPortfolio
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient().db
+
+
+def portfolio_with_stock(db, warm_start=None):
+    portfolio = StockPortfolio(db.stocks, warm_start=warm_start)
+    status, id = portfolio.insert_stock("Apple", "AAPL", 100.0, "NA", 5)
+    portfolio.retrieve_stocks()
+    return portfolio
+
+
+def test_round_trip_restores_holdings_and_prices(db, tmp_path):
+    path = str(tmp_path / "stocks.snapshot")
+    portfolio = portfolio_with_stock(db)
+    price_cache = PriceCache(60)
+    price_cache.put("AAPL", 150.0)
+    snapshotter = Snapshotter(path, "stocks")
+    snapshotter.attach(portfolio, price_cache)
+    assert snapshotter.write()
+    assert not snapshotter.write()
+
+    restored = Snapshotter(path, "stocks")
+    version, stocks = restored.load_holdings()
+    assert version == portfolio.portfolio_version()
+    assert [stock["symbol"] for stock in stocks] == ["AAPL"]
+    assert restored.load_prices()["AAPL"][0] == 150.0
+    assert PriceCache(60, warm_start=restored.load_prices).get("AAPL") == 150.0
+
+
+def test_snapshot_without_price_cache_holds_no_prices(db, tmp_path):
+    path = str(tmp_path / "other.snapshot")
+    snapshotter = Snapshotter(path, "stocks")
+    snapshotter.attach(portfolio_with_stock(db))
+    assert snapshotter.write()
+    assert Snapshotter(path, "stocks").load_prices() == {}
+
+
+def test_snapshot_of_another_portfolio_or_corrupt_file_is_ignored(db, tmp_path):
+    path = str(tmp_path / "stocks.snapshot")
+    snapshotter = Snapshotter(path, "stocks")
+    snapshotter.attach(portfolio_with_stock(db))
+    snapshotter.write()
+    assert Snapshotter(path, "other").load_holdings() is None
+
+    with open(path, "r+b") as f:
+        f.truncate(20)
+    assert Snapshotter(path, "stocks").load_holdings() is None
+
+
+def test_stale_snapshot_version_is_rejected(db, tmp_path):
+    path = str(tmp_path / "stocks.snapshot")
+    snapshotter = Snapshotter(path, "stocks")
+    portfolio = portfolio_with_stock(db)
+    snapshotter.attach(portfolio)
+    snapshotter.write()
+    # Written after the snapshot, e.g. by another replica
+    portfolio.insert_stock("Tesla", "TSLA", 200.0, "NA", 3)
+
+    restarted = StockPortfolio(db.stocks, warm_start=Snapshotter(path, "stocks").load_holdings)
+    assert sorted(stock["symbol"] for stock in restarted.retrieve_stocks()[1]) == ["AAPL", "TSLA"]
+
+
+def test_matching_snapshot_version_warm_starts_without_a_scan(db, tmp_path):
+    path = str(tmp_path / "stocks.snapshot")
+    snapshotter = Snapshotter(path, "stocks")
+    snapshotter.attach(portfolio_with_stock(db))
+    snapshotter.write()
+    # Only the snapshot knows this stock, so serving it proves Mongo was not scanned
+    db.stocks.delete_many({})
+
+    restarted = StockPortfolio(db.stocks, warm_start=Snapshotter(path, "stocks").load_holdings)
+    assert [stock["symbol"] for stock in restarted.retrieve_stocks()[1]] == ["AAPL"]
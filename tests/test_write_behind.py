@@ -0,0 +1,87 @@
+import mongomock
+import pytest
+
+from write_behind import WriteBehindQueue
+
+
+def stock(id, shares):
+    return {"id": id, "name": id, "symbol": id.upper(), "purchase price": 1.0, "purchase date": "NA", "shares": shares}
+
+
+@pytest.fixture
+def collection():
+    stocks = mongomock.MongoClient().db.stocks
+    stocks.insert_many([{"_id": id, **stock(id, 1)} for id in ("a", "b")])
+    return stocks
+
+
+def test_recover_replays_acknowledged_updates(collection, tmp_path):
+    log_path = str(tmp_path / "stocks.wal")
+    queue = WriteBehindQueue(collection, log_path, 100, 60, lambda batch: None)
+    queue.enqueue("a", stock("a", 2))
+    queue.enqueue("a", stock("a", 3))
+    queue.enqueue("b", stock("b", 4))
+    queue.log.close()  # crash before any flush
+
+    recovered = WriteBehindQueue(collection, log_path, 100, 60, lambda batch: None)
+    assert recovered.seq == 3
+    assert recovered.pending_updates() == {"a": stock("a", 3), "b": stock("b", 4)}
+    assert recovered.flush() == 2
+    assert collection.find_one({"_id": "a"})["shares"] == 3
+
+
+def test_recover_skips_torn_last_line(collection, tmp_path):
+    log_path = tmp_path / "stocks.wal"
+    queue = WriteBehindQueue(collection, str(log_path), 100, 60, lambda batch: None)
+    queue.enqueue("a", stock("a", 2))
+    queue.log.close()
+    with open(log_path, "a", encoding="utf-8") as f:
+        f.write('{"seq":2,"id":"b","fie')
+
+    recovered = WriteBehindQueue(collection, str(log_path), 100, 60, lambda batch: None)
+    assert recovered.pending_updates() == {"a": stock("a", 2)}
+
+
+def test_failed_report_stays_in_log_and_is_retried(collection, tmp_path):
+    log_path = str(tmp_path / "stocks.wal")
+    reports = []
+
+    def on_flush(batch):
+        reports.append(batch)
+        if len(reports) == 1:
+            raise RuntimeError("report failed")
+
+    queue = WriteBehindQueue(collection, log_path, 100, 60, on_flush)
+    queue.enqueue("a", stock("a", 2))
+    with pytest.raises(RuntimeError):
+        queue.flush()
+    assert collection.find_one({"_id": "a"})["shares"] == 2
+    assert WriteBehindQueue(collection, log_path, 100, 60, lambda batch: None).pending_updates() == {"a": stock("a", 2)}
+
+    queue.enqueue("b", stock("b", 5))
+    queue.flush()
+    assert reports[1] == {"a": stock("a", 2), "b": stock("b", 5)}
+    assert WriteBehindQueue(collection, log_path, 100, 60, lambda batch: None).pending_updates() == {}
+
+
+def test_updates_enqueued_during_a_log_rewrite_are_kept(collection, tmp_path):
+    log_path = str(tmp_path / "stocks.wal")
+    queue = WriteBehindQueue(collection, log_path, 100, 60, lambda batch: None)
+    write_entries = queue._write_entries
+    enqueued = []
+
+    def write_entries_then_enqueue(f, seq, entries):
+        write_entries(f, seq, entries)
+        # Updates keep being acknowledged while the new log is written, up to the copy under the lock
+        if len(enqueued) < WriteBehindQueue.REWRITE_ROUNDS:
+            enqueued.append(queue.enqueue("b", stock("b", 10 + len(enqueued))))
+
+    queue._write_entries = write_entries_then_enqueue
+    queue.enqueue("a", stock("a", 2))
+    queue.flush()
+    queue.enqueue("a", stock("a", 3))
+    queue.log.close()
+
+    recovered = WriteBehindQueue(collection, log_path, 100, 60, lambda batch: None)
+    assert recovered.seq == queue.seq
+    assert recovered.pending_updates() == {"a": stock("a", 3), "b": stock("b", 12)}